@@ -11,6 +11,7 @@ from pydantic import BaseModel
 from pydantic.fields import ModelField
 from sqlalchemy import delete, Column, Table, insert
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, AsyncEngine
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import InstrumentedAttribute, RelationshipProperty
 from sqlmodel import SQLModel, select
 from sqlmodel.engine.result import ScalarResult
@@ -26,10 +27,11 @@ from fastapi_amis_admin.amis.types import BaseAmisApiOut, BaseAmisModel, AmisAPI
 from fastapi_amis_admin.amis_admin.parser import AmisParser
 from fastapi_amis_admin.crud.base import RouterMixin
 from fastapi_amis_admin.crud._sqlmodel import SQLModelCrud, SQLModelSelector
-from fastapi_amis_admin.crud.parser import SQLModelFieldParser, SQLModelField, SQLModelListField
-from fastapi_amis_admin.crud.schema import CrudEnum, BaseApiOut
-from fastapi_amis_admin.crud.utils import parser_item_id, schema_create_by_schema, parser_str_set_list
-from fastapi_amis_admin.utils.db import SqlalchemyAsyncClient
+from fastapi_amis_admin.crud.parser import SQLModelFieldParser, SQLModelListField
+from fastapi_amis_admin.crud.schema import CrudEnum, BaseApiOut, QueryAdvice
+from fastapi_amis_admin.crud.utils import parser_item_id, schema_create_by_schema, parser_str_set_list, chunks
+from fastapi_amis_admin.utils.cache import table_generation
+from fastapi_amis_admin.utils.db import SqlalchemyAsyncClient, SqlalchemySyncClient, PoolStatus, TimedAsyncQueuePool, set_sqlite_pragmas
 from fastapi_amis_admin.amis_admin.settings import Settings
 from fastapi_amis_admin.utils.functools import cached_property
 
@@ -99,15 +101,39 @@ class LinkModelForm:
         ):
             if not await self.pk_admin.has_update_permission(request, item_id, None):
                 return self.pk_admin.error_no_router_permission(request)
-            link_id = parser_str_set_list(link_id)
-            stmt = delete(self.link_model).where(self.link_col.in_(link_id)).where(self.item_col.in_(item_id))
-            result = await db.execute(stmt)
-            if result.rowcount:  # type: ignore
-                await db.commit()
-            return BaseApiOut(data=result.rowcount)  # type: ignore
+            count = await self._delete_links(db, item_id, parser_str_set_list(link_id))
+            return BaseApiOut(data=count)
+
+        return route
+
+    @property
+    def route_delete_items(self):
+        async def route(
+                request: Request,
+                item_id: List[str] = Depends(parser_item_id),
+                link_id: Union[List[str], str] = Body(..., embed=True, title='link_id', example=[1, 2, 3],
+                                                      description='link model primary keys'),
+                db: AsyncSession = Depends(self.session_factory)
+        ):
+            if not await self.pk_admin.has_update_permission(request, item_id, None):
+                return self.pk_admin.error_no_router_permission(request)
+            link_id = parser_str_set_list(link_id) if isinstance(link_id, str) else list(set(link_id))
+            count = await self._delete_links(db, item_id, link_id)
+            return BaseApiOut(data=count)
 
         return route
 
+    async def _delete_links(self, db: AsyncSession, item_id: List[str], link_id: List[str]) -> int:
+        count = 0
+        for chunk in chunks(link_id, self.pk_admin.bulk_chunk_size):
+            stmt = delete(self.link_model).where(self.link_col.in_(chunk)).where(self.item_col.in_(item_id))
+            result = await db.execute(stmt)
+            count += result.rowcount
+        if count:
+            await db.commit()
+            await table_generation.bump(self.link_model.name)
+        return count
+
     @property
     def route_create(self):
         async def route(
@@ -124,11 +150,14 @@ class LinkModelForm:
             for item in item_id:
                 for link in link_id:
                     values.append({self.link_col.key: link, self.item_col.key: item})
-            stmt = insert(self.link_model).values(values).prefix_with('OR IGNORE')
-            result = await db.execute(stmt)
-            if result.rowcount:  # type: ignore
+            count = 0
+            for chunk in chunks(values, self.pk_admin.bulk_chunk_size):
+                result = await db.execute(insert(self.link_model).prefix_with('OR IGNORE'), chunk)
+                count += result.rowcount
+            if count:
                 await db.commit()
-            return BaseApiOut(data=result.rowcount)  # type: ignore
+                await table_generation.bump(self.link_model.name)
+            return BaseApiOut(data=count)
 
         return route
 
@@ -158,7 +187,9 @@ class LinkModelForm:
 
             button_delete = ActionType.Ajax(actionType='ajax', label='移除关联', level=LevelEnum.danger,
                                             confirmText='确定要移除关联?',
-                                            api=f"delete:{self.pk_admin.app.router_path}{self.pk_admin.router.prefix}{self.path}" + '/${query.link_item_id}?link_id=${IF(ids, ids, id)}')  # ${IF(ids, ids, id)} # ${ids|raw}${id}
+                                            api=AmisAPI(method='post',
+                                                        url=f"{self.pk_admin.app.router_path}{self.pk_admin.router.prefix}{self.path}" + '/${query.link_item_id}/delete',
+                                                        data={'link_id': '${IF(ids, ids, id)}'}))
             adaptor = 'if(("undefined"==typeof body_bulkActions_1)||!body_bulkActions_1){action=' + button_delete.amis_json() + ';payload.data.body.headerToolbar.push(' + button_create_dialog.amis_json() + ');payload.data.body.bulkActions.push(action);payload.data.body.itemActions.push(action);body_headerToolbar_1=payload.data.body.headerToolbar;body_bulkActions_1=payload.data.body.bulkActions;body_itemActions_1=payload.data.body.itemActions;}else{payload.data.body.headerToolbar=body_headerToolbar_1;payload.data.body.bulkActions=body_bulkActions_1;payload.data.body.itemActions=body_itemActions_1;}return payload;'
         return Service(
             schemaApi=AmisAPI(method='get', url=url, cache=20000, responseData=dict(controls=[picker]),
@@ -174,6 +205,13 @@ class LinkModelForm:
             response_model=BaseApiOut[int],
             name=self.link_model.name + '_Delete'
         )
+        self.pk_admin.router.add_api_route(
+            self.path + '/{item_id}/delete',
+            self.route_delete_items,
+            methods=["POST"],
+            response_model=BaseApiOut[int],
+            name=self.link_model.name + '_DeleteItems'
+        )
         self.pk_admin.router.add_api_route(
             self.path + '/{item_id}',
             self.route_create,
@@ -191,18 +229,26 @@ class BaseModelAdmin(SQLModelCrud):
     link_model_fields: List[InstrumentedAttribute] = []  # 内联字段
     link_model_forms: List[LinkModelForm] = []
     bulk_edit_fields: List[Union[SQLModelListField, FormItem]] = []  # 批量编辑字段
-    search_fields: List[SQLModelField] = []  # 模糊搜索字段
 
     def __init__(self, app: "AdminApp"):
         assert self.model, 'model is None'
         assert app, 'app is None'
         self.app = app
-        self.session_factory = self.session_factory or self.app.db.session_factory
+        db_session_factory = self.app.db.session_factory
+        if isinstance(self.app.db, SqlalchemySyncClient):  # 同步引擎, 数据库操作在线程池中执行
+            db_session_factory = self.app.db.session_factory_async
+        self.session_factory = self.session_factory or db_session_factory
+        if self.session_factory_read is None and self.session_factory == db_session_factory:
+            self.session_factory_read = self.app.db.session_factory_read
+        self.list_explain = self.list_explain or self.app.site.settings.debug
         self.parser = SQLModelFieldParser(default_model=self.model)
         list_display_insfield = self.parser.filter_insfield(self.list_display)
         self.list_filter = self.list_filter or list_display_insfield
-        self.fields = self.fields or [self.model]
+        self.fields = [*(self.fields or [self.model])]  # 复制后追加, 不修改类属性
         self.fields.extend(list_display_insfield)
+        self.fields.extend(self.parser.filter_insfield(self.list_filter))  # 关联模型字段将自动连接查询
+        self.foreign_key_labels = self.foreign_key_labels or self._get_default_fk_labels(
+            self.parser.filter_insfield(self.fields))
         super().__init__(self.model, self.session_factory)
 
     @cached_property
@@ -219,8 +265,22 @@ class BaseModelAdmin(SQLModelCrud):
     async def get_list_filter(self, request: Request) -> List[Union[SQLModelListField, FormItem]]:
         return self.list_filter or list(self.schema_filter.__fields__.values())
 
+    def _get_default_fk_labels(self, insfields: List[InstrumentedAttribute]) -> Dict[InstrumentedAttribute, str]:
+        """列表显示的外键字段默认显示关联记录的name字段,与外键选择器的labelField一致"""
+        labels = {}
+        for insfield in insfields:
+            column = self.parser.get_column(insfield)
+            foreign_keys = list(column.foreign_keys) if column is not None else []
+            if foreign_keys and 'name' in foreign_keys[0].column.table.columns:
+                labels[insfield] = 'name'
+        return labels
+
     async def get_list_column(self, request: Request, modelfield: ModelField) -> TableColumn:
-        return AmisParser(modelfield).as_table_column()
+        column = AmisParser(modelfield).as_table_column()
+        if modelfield.name in self._fk_labels and not column.type:
+            column.type = 'tpl'
+            column.tpl = '${%s__label || %s}' % (modelfield.alias, modelfield.alias)
+        return column
 
     async def get_list_columns(self, request: Request) -> List[TableColumn]:
         columns = []
@@ -252,15 +312,22 @@ class BaseModelAdmin(SQLModelCrud):
             modelfield = self.parser.get_modelfield(field, deepcopy=True)
             if modelfield and issubclass(modelfield.type_, (datetime.datetime, datetime.date, datetime.time)):
                 data.update({modelfield.alias: '[-]$' + modelfield.alias})
-        api = AmisAPI(method='POST', url=f'{self.router_path}/list?' + 'page=${page}&perPage=${perPage}',
-                      data=data)
+        url = f'{self.router_path}/list?' + 'page=${page}&perPage=${perPage}'
+        if self.list_keyset:
+            url += '&cursor=${IF(page > 1, next_cursor, "")}'
+        api = AmisAPI(method='POST', url=url, data=data)
         return api
 
     async def get_list_table(self, request: Request) -> TableCRUD:
         headerToolbar = ["filter-toggler", "reload", "bulkActions", {"type": "columns-toggler", "align": "right"},
                          {"type": "drag-toggler", "align": "right"}, {"type": "pagination", "align": "right"},
-                         {"type": "tpl", "tpl": "当前有 ${total} 条数据.", "className": "v-middle", "align": "right"}]
+                         {"type": "tpl", "tpl": "当前有 ${total}${IF(total_capped, '+', '')} 条数据.", "className": "v-middle",
+                          "align": "right"}]
         headerToolbar.extend(await self.get_actions_on_header_toolbar(request))
+        footerToolbar = ["statistics", "switch-per-page", "pagination", "load-more", "export-csv"]
+        if self.list_keyset:  # 游标分页只支持顺序加载
+            headerToolbar = [item for item in headerToolbar if item != {"type": "pagination", "align": "right"}]
+            footerToolbar.remove("pagination")
         table = TableCRUD(
             api=await self.get_list_filter_api(request),
             autoFillHeight=True,
@@ -273,9 +340,15 @@ class BaseModelAdmin(SQLModelCrud):
             perPage=self.list_per_page,
             itemActions=await self.get_actions_on_item(request),
             bulkActions=await self.get_actions_on_bulk(request),
-            footerToolbar=["statistics", "switch-per-page", "pagination", "load-more", "export-csv"],
+            footerToolbar=footerToolbar,
             columns=await self.get_list_columns(request),
         )
+        if self.list_display:  # 只查询列表显示的字段
+            fields = [column.name for column in table.columns if getattr(column, 'name', None)]
+            table.api.url += '&fields=' + ','.join(fields)
+        if await self.has_update_permission(request, None, None):
+            table.quickSaveApi = AmisAPI(method='put', url=f'{self.router_path}/item',
+                                         requestAdaptor='api.data = api.data.rowsDiff; return api;')
         if self.link_model_forms:
             table.footable = True
         return table
@@ -325,14 +398,17 @@ class BaseModelAdmin(SQLModelCrud):
 
     async def get_update_form(self, request: Request, bulk: bool = False) -> Form:
         if bulk == False:
-            api = f'put:{self.router_path}/item/$id'
             fields = self.schema_update.__fields__.values()
+            body = await self._conv_modelfields_to_formitems(request, fields, CrudEnum.update)
+            api = f'put:{self.router_path}/item/$id'
+            init_api = f'get:{self.router_path}/item/$id'  # 列表数据可能只包含部分字段
         else:
-            api = f'put:{self.router_path}/item/' + '${ids|raw}'
-            fields = self.bulk_edit_fields
-        form = Form(api=api, name=CrudEnum.update,
-                    body=await self._conv_modelfields_to_formitems(request, fields, CrudEnum.update), submitText=None,
-                    trimValues=True)
+            body = await self._conv_modelfields_to_formitems(request, self.bulk_edit_fields, CrudEnum.update)
+            data = {item.name: '${%s}' % item.name for item in body if getattr(item, 'name', None)}
+            api = AmisAPI(method='post', url=f'{self.router_path}/items/update',
+                          data={'item_id': '${ids|split}', 'data': data})
+            init_api = None
+        form = Form(api=api, initApi=init_api, name=CrudEnum.update, body=body, submitText=None, trimValues=True)
         return form
 
     async def get_create_action(self, request: Request, bulk: bool = False) -> Optional[Action]:
@@ -371,11 +447,21 @@ class BaseModelAdmin(SQLModelCrud):
         else:
             action = ActionType.Ajax(label='批量删除',
                                      confirmText='确定要批量删除?',
-                                     api=f"delete:{self.router_path}/item/" + '${ids|raw}')
+                                     api=AmisAPI(method='post', url=f'{self.router_path}/items/delete',
+                                                 data={'item_id': '${ids|split}'}))
         return action
 
+    async def get_export_action(self, request: Request) -> Optional[Action]:
+        if not await self.has_list_permission(request, None, None):
+            return None
+        api = await self.get_list_filter_api(request)
+        api.url = f'{self.router_path}/export?' + 'format=csv&orderBy=${orderBy}&orderDir=${orderDir}'
+        api.responseType = 'blob'
+        return ActionType.Ajax(actionType='download', icon='fa fa-download pull-left', label='导出', api=api)
+
     async def get_actions_on_header_toolbar(self, request: Request) -> List[Action]:
-        actions = [await self.get_create_action(request, bulk=False)]
+        actions = [await self.get_create_action(request, bulk=False),
+                   await self.get_export_action(request)]
         return list(filter(None, actions))
 
     async def get_actions_on_item(self, request: Request) -> List[Action]:
@@ -666,7 +752,7 @@ class ModelAdmin(BaseModelAdmin, PageAdmin):
         PageAdmin.__init__(self, app)
 
     def register_router(self):
-        self.link_model_forms: List[LinkModelForm] = self.get_link_model_forms()
+        self.link_model_forms: List[LinkModelForm] = self.link_model_forms or self.get_link_model_forms()
         for form in self.link_model_forms:
             form.register_router()
         self.register_crud()
@@ -734,7 +820,8 @@ class ModelAction(BaseFormAdmin, BaseModelAction):
 
 class AdminApp(PageAdmin):
     group_schema: Union[PageSchema, str] = None
-    engine: AsyncEngine = None
+    engine: Union[AsyncEngine, Engine] = None  # 同步引擎将在线程池中执行数据库操作
+    engine_replicas: List[AsyncEngine] = []  # 只读从库
     page_path = '/amis.json'
     page_parser_mode = 'json'
 
@@ -742,7 +829,21 @@ class AdminApp(PageAdmin):
         super().__init__(app)
         self.engine = self.engine or self.app.site.engine
         assert self.engine, 'engine is None'
-        self.db = SqlalchemyAsyncClient(self.engine)
+        if self.app is not self and self.engine is self.app.site.engine:
+            self.db = self.app.site.db
+        elif isinstance(self.engine, Engine):
+            self.db = SqlalchemySyncClient(self.engine)
+        else:
+            settings = self.app.site.settings
+            sqlite_profile = settings.database_sqlite_profile and self.engine.dialect.name == 'sqlite'
+            if settings.database_sqlite_profile:  # 连接参数与串行写入在同一处启用
+                for engine in [self.engine, *self.engine_replicas]:
+                    if engine.dialect.name == 'sqlite':
+                        set_sqlite_pragmas(engine)
+            self.db = SqlalchemyAsyncClient(self.engine, replicas=self.engine_replicas,
+                                            replica_strategy=settings.database_replica_strategy,
+                                            read_your_writes=settings.database_read_your_writes,
+                                            serialize_writes=sqlite_profile)
         self._pages_dict: Dict[str, Tuple[PageSchema, List[Union[PageSchema, BaseAdmin]]]] = {}
         self._admins_dict: Dict[Type[BaseAdmin], Optional[BaseAdmin]] = {}
 
@@ -764,6 +865,9 @@ class AdminApp(PageAdmin):
         [self.create_admin_instance(admin_cls) for admin_cls in self._admins_dict.keys()]
 
     def _register_admin_router_all(self):
+        for admin in self._admins_dict.values():  # 先绑定内联字段, 关联模型注册路由时才包含关联过滤参数
+            if isinstance(admin, ModelAdmin):
+                admin.link_model_forms = admin.get_link_model_forms()
         for admin in self._admins_dict.values():
             if isinstance(admin, RouterAdmin):  # 注册路由
                 admin.register_router()
@@ -795,6 +899,21 @@ class AdminApp(PageAdmin):
                 return admin.get_model_admin(table_name)
         return None
 
+    async def create_search_index_all(self) -> None:
+        for admin in self._admins_dict.values():
+            if isinstance(admin, AdminApp):
+                await admin.create_search_index_all()
+            elif isinstance(admin, SQLModelCrud):
+                await admin.create_search_index()
+
+    async def get_query_advices(self) -> List[QueryAdvice]:
+        advices = {}
+        for admin in self._admins_dict.values():
+            if isinstance(admin, (AdminApp, SQLModelCrud)):
+                for advice in await admin.get_query_advices():
+                    advices.setdefault((advice.table, advice.column, advice.usage), advice)
+        return list(advices.values())
+
     def register_admin(self, *admin_cls: Type[_BaseAdminT]) -> Type[_BaseAdminT]:
         [self._admins_dict.update({cls: None}) for cls in admin_cls if cls]
         return admin_cls[0]
@@ -862,21 +981,53 @@ class AdminApp(PageAdmin):
 
 class BaseAdminSite(AdminApp):
 
-    def __init__(self, settings: Settings, fastapi: FastAPI = None, engine: AsyncEngine = None):
+    def __init__(self, settings: Settings, fastapi: FastAPI = None, engine: Union[AsyncEngine, Engine] = None,
+                 engine_replicas: List[AsyncEngine] = None):
         self.settings = settings
         self.fastapi = fastapi or FastAPI(debug=settings.debug, reload=settings.debug)
         self.router = self.fastapi.router
-        self.engine = engine or create_async_engine(settings.database_url_async, echo=settings.debug, future=True)
+        self.engine = engine or self.create_engine(settings.database_url_async)
+        self.engine_replicas = engine_replicas or [self.create_engine(url)
+                                                   for url in settings.database_replicas_url_async]
         super().__init__(self)
 
     @cached_property
     def router_path(self) -> str:
         return self.settings.site_url + self.settings.root_path + self.router.prefix
 
+    def create_engine(self, url: str) -> AsyncEngine:
+        kwargs = {key: getattr(self.settings, f'database_{key}') for key in
+                  ['pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle']}
+        kwargs = {key: val for key, val in kwargs.items() if val is not None}
+        if self.settings.database_pool_size is not None:
+            kwargs['poolclass'] = TimedAsyncQueuePool
+        return create_async_engine(url, echo=self.settings.debug, future=True,
+                                   pool_pre_ping=self.settings.database_pool_pre_ping, **kwargs)
+
+    def register_router(self):
+        super().register_router()
+        self.router.add_api_route('/db/pool_status', self.route_pool_status, methods=['GET'],
+                                  response_model=BaseApiOut[List[PoolStatus]],
+                                  dependencies=[Depends(self.page_permission_depend)], include_in_schema=False)
+        return self
+
+    async def route_pool_status(self):
+        return BaseApiOut(data=self.db.get_pool_status())
+
     def mount_app(self, fastapi: FastAPI, name: str = None) -> None:
         self.register_router()
         fastapi.mount(self.settings.root_path, self.fastapi, name=name)
+        if self.settings.database_pool_warmup:
+            fastapi.add_event_handler('startup', self.warmup_db)
+        fastapi.add_event_handler('shutdown', self.db.dispose)
+
+    async def warmup_db(self) -> None:
+        await self.db.warmup(self.settings.database_pool_warmup)
 
     async def create_db_and_tables(self) -> None:
-        async with self.db.engine.begin() as conn:
-            await conn.run_sync(SQLModel.metadata.create_all)
+        if isinstance(self.db, SqlalchemySyncClient):
+            await self.db.run_sync(SQLModel.metadata.create_all)
+        else:
+            async with self.db.engine.begin() as conn:
+                await conn.run_sync(SQLModel.metadata.create_all)
+        await self.create_search_index_all()
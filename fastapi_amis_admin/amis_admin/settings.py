@@ -1,3 +1,5 @@
+from typing import List, Optional
+
 from pydantic import BaseSettings, Field
 
 
@@ -9,3 +11,13 @@ class Settings(BaseSettings):
     root_path: str = '/admin'
     database_url_async: str = Field(..., env='DATABASE_URL_ASYNC')
 
+    database_replicas_url_async: List[str] = []  # 只读从库连接地址
+    database_replica_strategy: str = 'round_robin'  # 从库选择策略: round_robin, least_connections
+    database_read_your_writes: float = 0  # 客户端写入后在该时间(秒)内从主库读取
+    database_pool_size: Optional[int] = None  # 连接池大小,设置后使用可统计等待时间的队列连接池
+    database_max_overflow: Optional[int] = None  # 连接池最大溢出连接数
+    database_pool_timeout: Optional[float] = None  # 获取连接的超时时间(秒)
+    database_pool_recycle: Optional[int] = None  # 连接回收时间(秒)
+    database_pool_pre_ping: bool = False  # 使用连接前检测连接是否可用
+    database_pool_warmup: int = 0  # 应用启动时预先建立的连接数
+    database_sqlite_profile: bool = False  # SQLite性能配置: 开启WAL等参数,并串行执行写事务
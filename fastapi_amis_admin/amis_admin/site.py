@@ -2,9 +2,11 @@ import os.path
 import platform
 import time
 import uuid
+from typing import List, Union
 
 from fastapi import UploadFile, File, FastAPI
 from pydantic import BaseModel
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.asyncio import AsyncEngine
 from starlette.requests import Request
 from starlette.staticfiles import StaticFiles
@@ -99,6 +101,7 @@ class FileAdmin(RouterAdmin):
 
 class AdminSite(BaseAdminSite):
 
-    def __init__(self, settings: Settings, fastapi: FastAPI = None, engine: AsyncEngine = None):
-        super().__init__(settings, fastapi, engine)
+    def __init__(self, settings: Settings, fastapi: FastAPI = None, engine: Union[AsyncEngine, Engine] = None,
+                 engine_replicas: List[AsyncEngine] = None):
+        super().__init__(settings, fastapi, engine, engine_replicas)
         self.register_admin(HomeAdmin, DocsAdmin, ReDocsAdmin, FileAdmin)
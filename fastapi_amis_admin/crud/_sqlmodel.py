@@ -1,5 +1,15 @@
+import asyncio
+import copy
+import csv
 import datetime
+import hashlib
+import io
+import itertools
+import logging
 import re
+import time
+from collections import namedtuple
+from contextlib import asynccontextmanager
 from enum import Enum
 from typing import (
     Any,
@@ -7,22 +17,37 @@ from typing import (
     List,
     Type,
     Optional,
-    Union, Dict, Tuple, AsyncGenerator, Pattern,
+    Union, Dict, Tuple, Set, AsyncGenerator, Pattern, Awaitable, Hashable,
 )
 from fastapi import Depends, Body, APIRouter, Query
-from pydantic import Json, BaseModel
-from sqlalchemy import insert, update, delete, func, Table, Column
+from fastapi.encoders import jsonable_encoder
+import ujson
+from pydantic import Json, BaseModel, ValidationError
+from pydantic.json import pydantic_encoder
+from pydantic.utils import smart_deepcopy
+from sqlalchemy import insert, update, delete, func, Table, Column, or_, and_, text, bindparam, \
+    literal_column, inspect as sa_inspect, cast, Text, JSON, exists, Integer
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Row
+from sqlalchemy.exc import DBAPIError, IntegrityError
 from sqlalchemy.future import select
-from sqlalchemy.orm import InstrumentedAttribute
-from sqlalchemy.sql.elements import BinaryExpression, UnaryExpression
+from sqlalchemy.orm import InstrumentedAttribute, MANYTOONE
+from sqlalchemy.sql.elements import BinaryExpression, UnaryExpression, BindParameter, ClauseElement
 from sqlmodel import SQLModel
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlmodel.sql.expression import Select
 from starlette.requests import Request
+from starlette.responses import StreamingResponse
 from .base import BaseCrud
-from .parser import SQLModelFieldParser, SQLModelListField
-from .schema import BaseApiOut, ItemListSchema
-from .utils import schema_create_by_modelfield, parser_item_id, parser_str_set_list, schema_create_by_schema
+from .parser import SQLModelFieldParser, SQLModelListField, SQLModelField
+from .advisor import QueryAdvisor, compile_select, explain_select, is_full_scan
+from .schema import BaseApiOut, ItemListSchema, Paginator, UpsertResultSchema, QueryAdvice, \
+    QueryPlanSchema, Aggregator, AggregateSchema
+from ..utils.cache import LRUCache, CacheInfo, BaseCacheBackend, table_generation
+from .utils import schema_create_by_modelfield, parser_item_id, parser_str_set_list, schema_create_by_schema, \
+    encode_cursor, decode_cursor, chunks
+
+logger = logging.getLogger(__name__)
 
 sql_operator_pattern: Pattern = re.compile(r'^\[(=|<=|<|>|>=|!|!=|<>|\*|!\*|~|!~|-)]')
 sql_operator_map: Dict[str, str] = {
@@ -41,6 +66,15 @@ sql_operator_map: Dict[str, str] = {
     '-': 'between',
 }
 
+# 关联过滤的默认策略: (包含, 不包含)
+link_strategies: Dict[str, Tuple[str, str]] = {
+    'postgresql': ('exists', 'exists'),  # EXISTS / NOT EXISTS 均可规划为半连接及反连接
+    'mysql': ('in', 'join'),  # IN 子查询使用半连接优化, LEFT JOIN ... IS NULL 反连接
+    'sqlite': ('in', 'exists'),
+}
+
+LinkClause = namedtuple('LinkClause', ['table', 'pk_col', 'link_col', 'item_ids', 'negate'])
+
 
 class SQLModelSelector:
     model: Type[SQLModel] = None
@@ -49,6 +83,11 @@ class SQLModelSelector:
     ordering: List[Union[SQLModelListField, UnaryExpression]] = []
     link_models: Dict[str, Tuple[Type[Table], Column, Column]] = {}
     pk_name: str = 'id'
+    filter_cache_size: int = 128  # 过滤条件结构编译缓存数量
+    search_fields: List[SQLModelField] = []  # 模糊搜索字段
+    search_fulltext: bool = False  # 搜索字段使用全文索引: SQLite FTS5, PostgreSQL tsvector. [~]由子串匹配变为按词前缀匹配
+    search_fulltext_config: str = 'simple'  # PostgreSQL 全文搜索配置
+    link_strategy: Optional[str] = None  # 关联过滤策略: in, exists, join; 默认按数据库方言选择
 
     def __init__(self, model: Type[SQLModel] = None, fields: List[SQLModelListField] = None) -> None:
         self.model = model or self.model
@@ -62,9 +101,56 @@ class SQLModelSelector:
         self._list_fields_ins: Dict[str, InstrumentedAttribute] = {self.parser.get_name(insfield): insfield for insfield
                                                                    in self.fields}
         assert self._list_fields_ins, 'fields is None'
+        # 客户端可以按fields参数选择字段子集, 编译结果需要限制数量
+        self._row_mappers = LRUCache(maxsize=self.filter_cache_size)
+        self._filter_cache = LRUCache(maxsize=self.filter_cache_size)
+        self._search_engine: Optional[str] = None  # 全文索引创建后为 fts5 或 tsvector
+        self._list_joins: List[Tuple[Table, Any, bool]] = self._calc_list_joins()
 
     async def get_select(self, request: Request) -> Select:
-        return select(*self._list_fields_ins.values()) if self._list_fields_ins else select(self.model)
+        if not self._list_fields_ins:
+            return select(self.model)
+        stmt = select(*self._list_fields_ins.values())
+        if self._list_joins:
+            stmt = stmt.select_from(self._get_list_from())
+        return stmt
+
+    def _calc_list_joins(self) -> List[Tuple[Table, Any, bool]]:
+        """根据外键或关系计算关联模型字段所需的连接: (关联表, 连接条件, 是否左外连接)"""
+        table = self.model.__table__
+        targets = []
+        for insfield in self._list_fields_ins.values():
+            target = getattr(insfield.class_, '__table__', None)
+            if target is not None and target is not table and target not in targets:
+                targets.append(target)
+        if not targets:
+            return []
+        relationships = {}
+        for rel in sa_inspect(self.model).relationships:
+            # 仅关联单条记录的关系, 一对多及多对多会使列表行重复
+            if rel.secondary is None and (rel.direction is MANYTOONE or not rel.uselist):
+                relationships.setdefault(rel.target, rel)
+        joins = []
+        for target in targets:
+            rel = relationships.get(target)
+            if rel is not None:
+                isouter = rel.direction is not MANYTOONE or any(col.nullable for col in rel.local_columns)
+                joins.append((target, rel.primaryjoin, isouter))
+                continue
+            fks = [fk for fk in table.foreign_keys if fk.column.table is target]
+            if len(fks) == 1:
+                joins.append((target, fks[0].parent == fks[0].column, fks[0].parent.nullable))
+                continue
+            # 没有或有多个外键时无法确定连接条件, 查询会产生笛卡尔积, 需重写get_select指定连接
+            logger.warning('Cannot join %s to %s: no many-to-one relationship or unique foreign key found, '
+                           'override get_select to join it explicitly', target.name, table.name)
+        return joins
+
+    def _get_list_from(self) -> Any:
+        from_ = self.model.__table__
+        for target, onclause, isouter in self._list_joins:
+            from_ = from_.join(target, onclause, isouter=isouter)
+        return from_
 
     def _calc_ordering(self, orderBy, orderDir):
         insfield = self._list_fields_ins.get(orderBy)
@@ -76,38 +162,168 @@ class SQLModelSelector:
             order = self.parser.filter_insfield(self.ordering, save_class=(UnaryExpression,))
         return order
 
+    def _get_row_mapper(self, row: Row, schema: Type[BaseModel]) -> Callable[[Row], BaseModel]:
+        """按查询语句的字段结构编译行转换函数,跳过数据库可信数据的校验, 只解析Json字段"""
+        key = (schema, row._fields)
+        mapper = self._row_mappers.get(key)
+        if mapper is not None:
+            return mapper
+        aliases = {field.alias: field.name for field in schema.__fields__.values()}
+        indexes = [(index, aliases[key]) for index, key in enumerate(self.parser.get_row_keys(row)) if key in aliases]
+        fields_set = frozenset(name for _, name in indexes)
+        missing = [field for field in schema.__fields__.values() if field.name not in fields_set]
+        # Json字段在文本列中保存为字符串, 需要解析校验
+        json_fields = [schema.__fields__[name] for name in fields_set if schema.__fields__[name].parse_json]
+        init_private = bool(schema.__private_attributes__)
+
+        def mapper(row: Row) -> BaseModel:
+            obj = schema.__new__(schema)
+            values = {name: row[index] for index, name in indexes}
+            for field in json_fields:
+                if isinstance(values[field.name], (str, bytes)):
+                    values[field.name], error = field.validate(values[field.name], values, loc=field.alias, cls=schema)
+                    if error:
+                        raise ValidationError([error], schema)
+            for field in missing:
+                values[field.name] = field.get_default()
+            object.__setattr__(obj, '__dict__', values)
+            object.__setattr__(obj, '__fields_set__', set(fields_set))
+            if init_private:
+                obj._init_private_attributes()
+            return obj
+
+        self._row_mappers.set(key, mapper)
+        return mapper
+
+    def _conv_rows(self, rows: List[Row], schema: Type[BaseModel]) -> List[BaseModel]:
+        if not rows:
+            return []
+        mapper = self._get_row_mapper(rows[0], schema)
+        return [mapper(row) for row in rows]
+
+    def _calc_keyset_fields(self, orderBy: str = None) -> List[InstrumentedAttribute]:
+        insfield = self._list_fields_ins.get(orderBy)
+        if insfield is None or insfield is self.pk:
+            return [self.pk]
+        return [insfield, self.pk]
+
+    def _calc_list_ordering(self, paginator: Paginator) -> Optional[List[UnaryExpression]]:
+        """OFFSET分页的排序. 开启游标分页时没有游标的页码与游标分页排序一致, 包含主键保证分页稳定"""
+        if self.list_keyset:  # 没有游标时只返回排序字段
+            return self._calc_keyset_clause(paginator)[0]
+        return self._calc_ordering(paginator.orderBy, paginator.orderDir)
+
+    def _calc_keyset_clause(self, paginator: Paginator) -> Tuple[List[UnaryExpression], Optional[Any], bool]:
+        """返回游标分页的排序字段,过滤条件,以及是否向前翻页"""
+        insfields = self._calc_keyset_fields(paginator.orderBy)
+        values = decode_cursor(paginator.cursor) if paginator.cursor else None
+        if not values or values[:2] != [paginator.orderBy, paginator.orderDir] \
+                or len(values) != 3 + len(insfields):
+            values = None
+        is_prev = bool(values and values[2])
+        is_desc = (paginator.orderDir == 'desc') != is_prev
+        order = [insfield.desc() if is_desc else insfield.asc() for insfield in insfields]
+        nullable = len(insfields) > 1 and self._is_nullable(insfields[0])
+        if nullable:  # 空值视为最大值, 各数据库的空值排序不同, 显式按是否为空排序
+            order.insert(0, insfields[0].is_(None).desc() if is_desc else insfields[0].is_(None).asc())
+        if values is None:
+            return order, None, False
+        keys = []
+        for insfield, value in zip(insfields, values[3:]):
+            if value is None and nullable and insfield is insfields[0]:
+                keys.append(None)
+                continue
+            value, error = self.parser.get_modelfield(insfield).validate(value, {}, loc='cursor')
+            if error:
+                return order, None, False
+            keys.append(value)
+        op = '__lt__' if is_desc else '__gt__'
+        clause = getattr(insfields[-1], op)(keys[-1])
+        if len(insfields) == 1:
+            return order, clause, is_prev
+        if keys[0] is None:  # 空值之后: 升序时为同为空值的数据, 降序时还包括全部非空数据
+            clause = and_(insfields[0].is_(None), clause)
+            if is_desc:
+                clause = or_(insfields[0].isnot(None), clause)
+        else:
+            clause = or_(getattr(insfields[0], op)(keys[0]), and_(insfields[0] == keys[0], clause))
+            if nullable and not is_desc:
+                clause = or_(clause, insfields[0].is_(None))
+        return order, clause, is_prev
+
+    def _is_nullable(self, insfield: InstrumentedAttribute) -> bool:
+        """排序字段是否可能为空值, 左外连接的关联表字段也可能为空值"""
+        column = self.parser.get_column(insfield)
+        return column is None or column.nullable or column.table is not self.model.__table__
+
+    def _calc_keyset_cursor(self, paginator: Paginator, row: Row, is_prev: bool = False) -> Optional[str]:
+        item = dict(zip(self.parser.get_row_keys(row), row))
+        values = []
+        for insfield in self._calc_keyset_fields(paginator.orderBy):
+            alias = self.parser.get_alias(insfield)
+            if alias not in item:
+                return None
+            values.append(item[alias])
+        return encode_cursor([paginator.orderBy, paginator.orderDir, int(is_prev), *values])
+
     @property
     def _select_maker(self):
         if self.link_models:
             def select_maker(stmt: Select = Depends(self.get_select),
-                             link_clause=Depends(self.get_link_clause)) -> Select:
+                             link_clause: Union[LinkClause, ClauseElement, None] = Depends(self.get_link_clause),
+                             dialect: Optional[str] = Depends(self._link_dialect)) -> Select:
                 if link_clause is not None:
-                    stmt = stmt.where(link_clause)
+                    stmt = self.calc_link_select(stmt, link_clause, dialect)
                 return stmt
         else:
             select_maker = self.get_select
         return select_maker
 
+    @property
+    def _link_dialect(self) -> Callable:
+        def dialect() -> Optional[str]:
+            return None
+
+        return dialect
+
     async def get_link_clause(self, request: Request, link_model: str = None,
                               link_item_id: Union[int, str] = Query(None, title='pk', example='1,2,3',
                                                                     description='Link Model Primary key or list of primary keys')) -> \
-            Optional[Any]:
+            Optional[LinkClause]:
         if link_model and link_item_id:
-            table, pk_col, link_col = self.link_models.get(link_model)
+            table, pk_col, link_col = self.link_models.get(link_model, (None, None, None))
             if table is not None:
-                op = 'in_'
-                if isinstance(link_item_id, str) and link_item_id.startswith('!'):
-                    op = 'not_in'
+                negate = isinstance(link_item_id, str) and link_item_id.startswith('!')
+                if negate:
                     link_item_id = link_item_id[1:]
                     if not link_item_id:
                         return None
-                link_item_id = parser_str_set_list(link_item_id)
-                if op == 'in_':
-                    return self.pk.in_(select(pk_col).where(link_col.in_(link_item_id)))
-                elif op == 'not_in':
-                    return self.pk.not_in(select(pk_col).where(link_col.in_(link_item_id)))
+                return LinkClause(table, pk_col, link_col, parser_str_set_list(link_item_id), negate)
         return None
 
+    def calc_link_select(self, stmt: Select, link_clause: Union[LinkClause, ClauseElement],
+                         dialect: str = None) -> Select:
+        """按关联过滤策略添加过滤条件, "!" 形式的不包含过滤不使用对NULL敏感的 NOT IN.
+        重写get_link_clause返回过滤条件表达式时, 直接添加到where子句"""
+        if not isinstance(link_clause, LinkClause):
+            return stmt.where(link_clause)
+        table, pk_col, link_col, item_ids, negate = link_clause
+        strategy = self.link_strategy or link_strategies.get(dialect, ('exists', 'exists'))[negate]
+        if strategy == 'join' and (negate or len(item_ids) == 1):  # 包含多个关联主键时连接会产生重复数据
+            link_table = table.alias(f'{table.name}_link')
+            link_pk, link_id = link_table.c[pk_col.name], link_table.c[link_col.name]
+            onclause = and_(link_pk == self.pk, link_id.in_(item_ids))
+            if negate:
+                return stmt.outerjoin(link_table, onclause).where(link_pk.is_(None))
+            return stmt.join(link_table, onclause)
+        if strategy == 'in':
+            subquery = select(pk_col).where(link_col.in_(item_ids))
+            if negate:
+                return stmt.where(self.pk.not_in(subquery.where(pk_col.isnot(None))))
+            return stmt.where(self.pk.in_(subquery))
+        clause = exists().where(pk_col == self.pk, link_col.in_(item_ids))
+        return stmt.where(~clause if negate else clause)
+
     @staticmethod
     def _parser_query_value(value: Any, operator: str = '__eq__') -> Tuple[Optional[str], Union[tuple, None]]:
         if isinstance(value, str):
@@ -130,30 +346,135 @@ class SQLModelSelector:
         return operator, (value,)
 
     def calc_filter_clause(self, data: Dict[str, Any]) -> List[BinaryExpression]:
-        lst = []
+        clauses, params = self.calc_filter_params(data)
+        return [clause.params(params) for clause in clauses]
+
+    def _calc_filter(self, data: Dict[str, Any]) -> Tuple[List[BinaryExpression], Dict[str, Any]]:
+        """路由使用的过滤条件, 子类重写calc_filter_clause时使用其结果, 否则使用结构缓存及绑定参数"""
+        if type(self).calc_filter_clause is not SQLModelSelector.calc_filter_clause:
+            return self.calc_filter_clause(data), {}
+        return self.calc_filter_params(data)
+
+    def calc_filter_params(self, data: Dict[str, Any]) -> Tuple[List[BinaryExpression], Dict[str, Any]]:
+        """计算查询过滤条件及绑定参数,相同结构的过滤条件只编译一次"""
+        shape, params = [], {}
         for k, v in data.items():
-            insfield = self._list_fields_ins.get(k)
-            if insfield:
+            if k in self._list_fields_ins:
                 operator, val = self._parser_query_value(v)
+                if operator == 'like' and self._search_engine and k in self._search_fields_names:
+                    term = self._calc_search_term(k, v[3:])
+                    if term:
+                        operator, val = self._search_engine, (term,)
                 if operator:
-                    lst.append(getattr(insfield, operator)(*val))
-        return lst
+                    shape.append((k, operator, len(val)))
+                    for value in val:
+                        params[f'_filter_{len(params)}'] = value
+        shape = tuple(shape)
+        clauses = self._filter_cache.get(shape)
+        if clauses is None:
+            clauses = self._compile_filter_clause(shape)
+            self._filter_cache.set(shape, clauses)
+        return clauses, params
+
+    def _compile_filter_clause(self, shape: Tuple[Tuple[str, str, int], ...]) -> List[BinaryExpression]:
+        clauses, index = [], 0
+        for k, operator, count in shape:
+            expanding = operator in ['in_', 'not_in']
+            params = [bindparam(f'_filter_{i}', expanding=expanding) for i in range(index, index + count)]
+            index += count
+            if operator in ['fts5', 'tsvector']:
+                clauses.append(self._calc_search_clause(k, operator, params[0]))
+            else:
+                clauses.append(getattr(self._list_fields_ins[k], operator)(*params))
+        return clauses
+
+    @property
+    def _search_fields_names(self) -> List[str]:
+        return [self.parser.get_name(insfield) for insfield in self.parser.filter_insfield(self.search_fields)]
+
+    def _get_search_table_name(self) -> str:
+        return f'{self.model.__tablename__}_fts'
+
+    def _calc_search_term(self, name: str, value: str) -> Optional[str]:
+        """将搜索关键字转换为全文索引前缀匹配语句,多个关键字需同时匹配"""
+        words = re.findall(r'\w+', value)
+        if not words:
+            return None
+        if self._search_engine == 'fts5':
+            column = self.parser.get_column(self._list_fields_ins[name])
+            return '{%s} : (%s)' % (column.name, ' '.join(f'"{word}"*' for word in words))
+        return ' & '.join(f'{word}:*' for word in words)
+
+    def _calc_search_clause(self, name: str, engine: str, param: BindParameter) -> Any:
+        if engine == 'fts5':
+            fts = self._get_search_table_name()
+            return self.pk.in_(select(literal_column('rowid')).select_from(text(f'"{fts}"'))
+                               .where(literal_column(f'"{fts}"').op('MATCH')(param)))
+        column = self.parser.get_column(self._list_fields_ins[name])
+        config = literal_column(f"'{self.search_fulltext_config}'::regconfig")
+        return func.to_tsvector(config, column).op('@@')(func.to_tsquery(config, param))
+
+    def filter_cache_info(self) -> CacheInfo:
+        return self._filter_cache.info()
 
 
 class SQLModelCrud(BaseCrud, SQLModelSelector):
     session_factory: Callable[..., AsyncGenerator[AsyncSession, Any]] = None
+    session_factory_read: Callable[..., AsyncGenerator[AsyncSession, Any]] = None  # 只读会话,默认同session_factory
     readonly_fields: List[SQLModelListField] = []  # 只读字段
+    list_keyset: bool = False  # 启用游标分页
+    count_strategy: str = 'exact'  # 总数统计策略: exact, capped, estimated, window
+    count_capped_max: int = 10000  # capped 策略的最大统计数量
+    export_chunk_size: int = 1000  # 导出数据时每批读取的数量
+    bulk_chunk_size: int = 500  # 批量写入时每批处理的数量
+    upsert_conflict_fields: List[SQLModelField] = []  # 新增或更新时的冲突判断字段,默认为主键
+    upsert_update_fields: List[SQLModelField] = []  # 冲突时需要更新的字段,默认为全部提交字段
+    read_cache: Optional[BaseCacheBackend] = None  # 按主键读取数据的缓存,例如: MemoryCacheBackend(ttl=60)
+    list_cache: Optional[BaseCacheBackend] = None  # 批量查询结果缓存,例如: MemoryCacheBackend(ttl=None)
+    list_cache_ttl: float = 10  # 批量查询缓存的有效时间(秒)
+    list_cache_stale_ttl: float = 60  # 缓存过期后仍可返回旧数据并后台刷新的时间(秒)
+    list_cache_prefetch: bool = False  # 后台预取下一页数据
+    foreign_key_labels: Dict[SQLModelField, SQLModelField] = {}  # 外键字段在列表中显示的关联记录标签,例如: {Article.category_id: Category.name}
+    foreign_key_label_ttl: float = 30  # 外键标签缓存的有效时间(秒)
+    list_preview_length: int = 0  # 批量查询时Text字段截取的长度, 默认0表示不截取
+    aggregate_max_groups: int = 1000  # 聚合查询最多返回的分组数量
+    aggregate_cache_ttl: float = 60  # 聚合查询结果缓存的有效时间(秒),需设置list_cache
 
     def __init__(self, model: Type[SQLModel], session_factory: Callable[..., AsyncGenerator[AsyncSession, Any]],
                  fields: List[SQLModelListField] = None,
                  router: APIRouter = None) -> None:
         self.session_factory = session_factory or self.session_factory
         assert self.session_factory, 'session_factory is None'
+        self.session_factory_read = self.session_factory_read or self.session_factory
         SQLModelSelector.__init__(self, model, fields)
         BaseCrud.__init__(self, self.model, router)
+        self._cache_tasks: Dict[Hashable, asyncio.Future] = {}
+        if self.list_cache is not None:  # 其他进程共享该缓存后端, 当前进程的写入需要更新其中的版本号
+            table_generation.register(self.list_cache)
+        self._fk_labels: Dict[str, Tuple[Column, Column]] = self._calc_fk_labels()
+        self._fk_label_cache = LRUCache(maxsize=self.filter_cache_size * 32, ttl=self.foreign_key_label_ttl)
+        self._list_schemas = LRUCache(maxsize=self.filter_cache_size)
+        self._list_previews: Dict[str, int] = self._calc_list_previews()
+        self._list_fields_alias: Dict[str, str] = {}  # 客户端字段名称或别名 -> 字段名称
+        for name, insfield in self._list_fields_ins.items():
+            alias = self.parser.get_alias(insfield)
+            self._list_fields_alias.update({name: name, alias: name, f'{alias}__label': name})
         if not self.schema_list:
             modelfields = list(filter(None, [self.parser.get_modelfield(insfield, deepcopy=True) for insfield in
                                              self._list_fields_ins.values()]))
+            for modelfield in modelfields:
+                if modelfield.alias in self._list_previews:  # 截取后的预览内容为字符串, 不再按JSON解析
+                    modelfield.type_ = str
+                    modelfield.outer_type_ = str
+                    modelfield.validators = []
+                    modelfield.parse_json = False
+            for name in self._fk_labels:
+                modelfield = self.parser.get_modelfield(self._list_fields_ins[name], deepcopy=True)
+                modelfield.name, modelfield.alias = f'{name}__label', f'{modelfield.alias}__label'
+                modelfield.type_ = str
+                modelfield.outer_type_ = str
+                modelfield.validators = []
+                modelfields.append(modelfield)
             self.schema_list = schema_create_by_modelfield(schema_name=self.schema_name_prefix + 'List',
                                                            modelfields=modelfields, set_none=True)
         if not self.schema_filter:
@@ -175,6 +496,54 @@ class SQLModelCrud(BaseCrud, SQLModelSelector):
             self.schema_update = schema_create_by_schema(self.schema_model, self.schema_name_prefix + 'Update',
                                                          exclude=exclude, set_none=True)
 
+    async def create_search_index(self, session: AsyncSession = None) -> None:
+        """创建搜索字段的全文索引并启用全文搜索, SQLite 使用 FTS5 外部内容表并通过触发器同步数据,
+        PostgreSQL 使用 GIN 表达式索引. 可重复调用, 应用启动时执行."""
+        if not self.search_fulltext or not self.search_fields:
+            return
+        if session is None:
+            async with self._session_scope() as session:
+                return await self.create_search_index(session)
+        dialect = session.sync_session.get_bind().dialect.name
+        table = self.model.__tablename__
+        columns = [self.parser.get_column(field).name for field in self.parser.filter_insfield(self.search_fields)]
+        if dialect == 'sqlite':
+            if not isinstance(self.model.__table__.c[self.pk_name].type, Integer):
+                # FTS5 外部内容表以主键作为 rowid, 主键不是整数时无法同步, 继续使用 like 过滤
+                logger.warning('Full-text search index of %s requires an integer primary key, skipped',
+                               self.model.__tablename__)
+                return
+            fts = self._get_search_table_name()
+            result = await session.execute(text('SELECT name FROM sqlite_master WHERE name = :name'),
+                                           {'name': f'{fts}_ai'})
+            if result.scalar() is None:  # 数据表重建后触发器会被删除,需要重建全文索引
+                await session.execute(text(f'DROP TABLE IF EXISTS "{fts}"'))
+                cols = ', '.join(f'"{col}"' for col in columns)
+                new = ', '.join(f'new."{col}"' for col in columns)
+                old = ', '.join(f'old."{col}"' for col in columns)
+                insert_new = f'INSERT INTO "{fts}"(rowid, {cols}) VALUES (new."{self.pk_name}", {new});'
+                delete_old = f'INSERT INTO "{fts}"("{fts}", rowid, {cols}) ' \
+                             f'VALUES (\'delete\', old."{self.pk_name}", {old});'
+                for sql in [
+                    f'CREATE VIRTUAL TABLE "{fts}" USING fts5({cols}, content=\'{table}\', '
+                    f'content_rowid=\'{self.pk_name}\')',
+                    f'CREATE TRIGGER "{fts}_ai" AFTER INSERT ON "{table}" BEGIN {insert_new} END',
+                    f'CREATE TRIGGER "{fts}_ad" AFTER DELETE ON "{table}" BEGIN {delete_old} END',
+                    f'CREATE TRIGGER "{fts}_au" AFTER UPDATE ON "{table}" BEGIN {delete_old} {insert_new} END',
+                    f'INSERT INTO "{fts}"("{fts}") VALUES (\'rebuild\')',
+                ]:
+                    await session.execute(text(sql))
+            self._search_engine = 'fts5'
+        elif dialect == 'postgresql':
+            for col in columns:
+                await session.execute(text(
+                    f'CREATE INDEX IF NOT EXISTS "ix_{table}_{col}_fts" ON "{table}" USING GIN '
+                    f'(to_tsvector(\'{self.search_fulltext_config}\'::regconfig, "{col}"))'))
+            self._search_engine = 'tsvector'
+        else:
+            return
+        await session.commit()
+
     @property
     def schema_name_prefix(self):
         if self.__class__ is SQLModelCrud:
@@ -196,6 +565,12 @@ class SQLModelCrud(BaseCrud, SQLModelSelector):
     async def on_filter_pre(self, request: Request, obj: BaseModel, **kwargs) -> Dict[str, Any]:
         return obj and {k: v for k, v in obj.dict(exclude_unset=True).items() if v is not None}
 
+    async def on_list_after(self, request: Request, data: ItemListSchema, session: AsyncSession = None,
+                            **kwargs) -> ItemListSchema:
+        if self._fk_labels and data.items:
+            await self._fetch_fk_labels(session, data.items)
+        return data
+
     @property
     def route_list(self) -> Callable:
 
@@ -203,32 +578,615 @@ class SQLModelCrud(BaseCrud, SQLModelSelector):
                 request: Request,
                 paginator: self.paginator = Depends(self.paginator),  # type: ignore
                 filter: self.schema_filter = Body(None),  # type: ignore
-                session: AsyncSession = Depends(self.session_factory),
+                session: AsyncSession = Depends(self.session_factory_read),
+                stmt: Select = Depends(self._select_maker),
+                fields: str = Query(None, example='id,name', description='Fields to return, comma separated'),
+        ):
+            if not await self.has_list_permission(request, paginator, filter):
+                return self.error_no_router_permission(request)
+            filter_data = await self.on_filter_pre(request, filter)
+            params = {}
+            if filter_data:
+                clauses, params = self._calc_filter(filter_data)
+                stmt = stmt.filter(*clauses)
+            if fields:
+                stmt = self._calc_sparse_select(stmt, fields, paginator)
+            if self._list_previews:
+                stmt = self._calc_preview_select(stmt, paginator)
+            if self.list_cache is None:
+                data = await self._fetch_list(session, stmt, paginator, params)
+            else:
+                data = await self._fetch_list_cached(request, session, stmt, paginator, filter_data, params)
+            data = await self.on_list_after(request, data, session=session)
+            await self._release_session(session)
+            data.query = dict(request.query_params)
+            data.filter = filter_data
+            schema = self._get_list_schema(stmt) if fields else self.schema_list
+            if schema is not self.schema_list:  # 裁剪后的数据按裁剪后的数据模型校验
+                return self.make_response(BaseApiOut(data=data), response_model=BaseApiOut[ItemListSchema[schema]])
+            return self.make_response(BaseApiOut(data=data))
+
+        return route
+
+    def _calc_sparse_select(self, stmt: Select, fields: str, paginator: Paginator) -> Select:
+        """只查询客户端需要的字段,主键及游标分页字段始终保留"""
+        names = {self._list_fields_alias.get(field) for field in fields.split(',')}
+        names.add(self.pk_name)
+        if self.list_keyset:
+            names.update(self.parser.get_name(insfield) for insfield in self._calc_keyset_fields(paginator.orderBy))
+        aliases = {self.parser.get_alias(insfield) for name, insfield in self._list_fields_ins.items()
+                   if name in names}
+        columns = [column for column in stmt.selected_columns if self.parser.get_alias(column) in aliases]
+        if not columns or len(columns) == len(stmt.selected_columns):
+            return stmt
+        return stmt.with_only_columns(*columns, maintain_column_froms=True)
+
+    def _calc_list_previews(self) -> Dict[str, int]:
+        """批量查询时需要截取的字段别名及长度: 设置list_preview_length时的Text字段,或通过Field(list_preview=...)指定.
+        JSON字段截取后不再是有效的JSON, 只在字段单独指定时截取"""
+        previews = {}
+        for insfield in self._list_fields_ins.values():
+            modelfield = self.parser.get_modelfield(insfield)
+            column = self.parser.get_column(insfield)
+            length = modelfield.field_info.extra.get('list_preview') if modelfield else None
+            if length is None and column is not None and isinstance(column.type, Text):
+                length = self.list_preview_length
+            if length:
+                previews[self.parser.get_alias(insfield)] = length
+        return previews
+
+    def _calc_preview_select(self, stmt: Select, paginator: Paginator) -> Select:
+        """将大字段替换为截取的预览内容,完整内容通过读取路由获取"""
+        keyset_aliases = set()
+        if self.list_keyset:  # 游标需要完整的排序字段值
+            keyset_aliases = {self.parser.get_alias(insfield)
+                              for insfield in self._calc_keyset_fields(paginator.orderBy)}
+        columns, changed = [], False
+        for column in stmt.selected_columns:
+            alias = self.parser.get_alias(column)
+            length = self._list_previews.get(alias)
+            if length and isinstance(column, Column) and alias not in keyset_aliases:
+                value = cast(column, Text) if isinstance(column.type, JSON) else column
+                column, changed = func.substr(value, 1, length).label(alias), True
+            columns.append(column)
+        return stmt.with_only_columns(*columns, maintain_column_froms=True) if changed else stmt
+
+    def _get_list_schema(self, stmt: Select) -> Type[BaseModel]:
+        """返回与查询字段对应的批量查询数据模型"""
+        keys = set(self.parser.get_select_keys(stmt))
+        names = set()
+        for name, modelfield in self.schema_list.__fields__.items():
+            if modelfield.alias in keys or (name.endswith('__label') and
+                                            self.schema_list.__fields__[name[:-7]].alias in keys):
+                names.add(name)
+        if len(names) == len(self.schema_list.__fields__):
+            return self.schema_list
+        key = tuple(sorted(names))
+        schema = self._list_schemas.get(key)
+        if schema is None:
+            schema = schema_create_by_schema(self.schema_list, self.schema_name_prefix + 'List', include=names)
+            self._list_schemas.set(key, schema)
+        return schema
+
+    async def _fetch_list(self, session: AsyncSession, stmt: Select, paginator: Paginator,
+                          params: Dict[str, Any] = None) -> ItemListSchema:
+        data = ItemListSchema(items=[])
+        schema = self._get_list_schema(stmt)
+        page, perPage = paginator.page, paginator.perPage
+        is_keyset = self.list_keyset and (paginator.cursor or page == 1)
+        count_window = paginator.show_total and self.count_strategy == 'window' and not is_keyset
+        if paginator.show_total and not count_window:
+            await self._fetch_total(session, stmt, data, params)
+        if is_keyset:
+            data.items = await self._fetch_keyset_items(session, stmt, paginator, data, params)
+            return data
+        orderBy = self._calc_list_ordering(paginator)
+        if orderBy:
+            stmt = stmt.order_by(*orderBy)
+        if count_window:
+            stmt = stmt.add_columns(func.count().over().label('_total'))
+        result = await session.execute(stmt.limit(perPage).offset((page - 1) * perPage), params)
+        rows = result.all()
+        data.items = self._conv_rows(rows, schema)
+        if count_window:
+            if rows:
+                data.total = rows[0]._mapping['_total']
+            elif page > 1:
+                await self._fetch_total(session, stmt, data, params)
+            else:
+                data.total = 0
+        return data
+
+    def _calc_fk_labels(self) -> Dict[str, Tuple[Column, Column]]:
+        """外键字段名称 -> (关联表主键, 关联表标签字段)"""
+        fk_labels = {}
+        for field, label in self.foreign_key_labels.items():
+            insfield = self.parser.get_insfield(field)
+            name = insfield and self.parser.get_name(insfield)
+            if name not in self._list_fields_ins:
+                continue
+            foreign_keys = list(self.parser.get_column(insfield).foreign_keys)
+            assert foreign_keys, f'{name} is not a foreign key'
+            pk_col = foreign_keys[0].column
+            label_col = pk_col.table.columns.get(label) if isinstance(label, str) else self.parser.get_column(label)
+            assert label_col is not None and label_col.table is pk_col.table, f'label of {name} is invalid'
+            fk_labels[name] = (pk_col, label_col)
+        return fk_labels
+
+    async def _fetch_fk_labels(self, session: AsyncSession, items: List[BaseModel]) -> None:
+        """按关联表批量查询当前页全部外键的标签,每个关联表只执行一次IN查询"""
+        groups: Dict[Tuple[Column, Column], List[str]] = {}
+        for name, cols in self._fk_labels.items():
+            if f'{name}__label' in items[0].__fields__:  # 未查询的外键字段不需要标签
+                groups.setdefault(cols, []).append(name)
+        for (pk_col, label_col), names in groups.items():
+            generation = await table_generation.get(self.list_cache, pk_col.table.name)
+            prefix = (pk_col.table.name, label_col.name, *generation)
+            labels, missing = {}, set()
+            for item in items:
+                for name in names:
+                    value = getattr(item, name)
+                    if value is None or value in labels:
+                        continue
+                    cached = self._fk_label_cache.get((*prefix, value))
+                    if cached is None:
+                        missing.add(value)
+                    else:
+                        labels[value] = cached[0]
+            cacheable = not self._is_replica_session(session)
+            for chunk in chunks(list(missing), self.bulk_chunk_size):
+                result = await session.execute(select(pk_col, label_col).where(pk_col.in_(chunk)))
+                for pk, label in result:
+                    labels[pk] = label
+                    if cacheable:
+                        self._fk_label_cache.set((*prefix, pk), (label,))
+            if missing and not cacheable:
+                self._refresh_fk_label_cache(prefix, pk_col, label_col, missing)
+            for item in items:
+                for name in names:
+                    setattr(item, f'{name}__label', labels.get(getattr(item, name)))
+
+    def _refresh_fk_label_cache(self, prefix: Tuple[Any, ...], pk_col: Column, label_col: Column,
+                                missing: Set[Any]) -> None:
+        """从库未命中缓存的外键标签在后台从主库读取并写入缓存"""
+
+        async def refresh(session: AsyncSession):
+            for chunk in chunks(list(missing), self.bulk_chunk_size):
+                result = await session.execute(select(pk_col, label_col).where(pk_col.in_(chunk)))
+                for pk, label in result:
+                    self._fk_label_cache.set((*prefix, pk), (label,))
+
+        self._refresh_cache(('label', *prefix, *sorted(missing, key=str)), refresh)
+
+    async def get_list_cache_scope(self, request: Request) -> str:
+        """批量查询缓存的权限范围,不同用户可见数据不同时需要重写,例如返回用户角色"""
+        return ''
+
+    def _get_list_cache_tables(self) -> List[str]:
+        tables = {self.model.__tablename__}
+        tables.update(table.name for table, _, _ in self.link_models.values())
+        tables.update(insfield.class_.__tablename__ for insfield in self._list_fields_ins.values()
+                      if hasattr(insfield, 'class_') and hasattr(insfield.class_, '__tablename__'))
+        return sorted(tables)
+
+    async def _get_list_cache_key(self, paginator: Paginator, filter_data: Optional[Dict[str, Any]],
+                                  link: Tuple[Optional[str], Optional[str]], scope: str,
+                                  fields: List[str] = None) -> str:
+        tables = self._get_list_cache_tables()
+        signature = [tables, await table_generation.get(self.list_cache, *tables), scope, link, fields,
+                     sorted(filter_data.items()) if filter_data else None,
+                     paginator.page, paginator.perPage, paginator.show_total,
+                     paginator.orderBy, paginator.orderDir, paginator.cursor]
+        digest = hashlib.md5(ujson.dumps(jsonable_encoder(signature)).encode()).hexdigest()
+        return f'{self.model.__tablename__}:list:{digest}'
+
+    async def _fetch_list_cached(self, request: Request, session: AsyncSession, stmt: Select, paginator: Paginator,
+                                 filter_data: Optional[Dict[str, Any]], params: Dict[str, Any]) -> ItemListSchema:
+        """读取批量查询缓存,数据过期后仍先返回旧数据,并在后台刷新"""
+        scope = await self.get_list_cache_scope(request)
+        link = (request.query_params.get('link_model'), request.query_params.get('link_item_id'))
+        fields = self.parser.get_select_keys(stmt)
+        key = await self._get_list_cache_key(paginator, filter_data, link, scope, fields)
+        value = await self.list_cache.get(key)
+        if value is None:
+            data = await self._fetch_list(session, stmt, paginator, params)
+            if self._is_replica_session(session):  # 从库数据可能落后于主库, 在后台从主库读取并写入缓存
+                self._refresh_list_cache(key, stmt, paginator, params)
+            else:
+                await self._set_list_cache(key, data)
+        else:
+            data = ItemListSchema(**{**value['data'], 'items': []})
+            schema = self._get_list_schema(stmt)
+            data.items = [schema.construct(**item) for item in value['data']['items']]
+            if value['expires'] <= time.time():
+                self._refresh_list_cache(key, stmt, paginator, params)
+        if self.list_cache_prefetch:
+            next_paginator = copy.copy(paginator)
+            if data.next_cursor:
+                next_paginator.cursor = data.next_cursor
+            elif self.list_keyset or len(data.items) < paginator.perPage:
+                return data
+            next_paginator.page += 1
+            next_key = await self._get_list_cache_key(next_paginator, filter_data, link, scope, fields)
+            if await self.list_cache.get(next_key) is None:
+                self._refresh_list_cache(next_key, stmt, next_paginator, params)
+        return data
+
+    async def _set_list_cache(self, key: str, data: ItemListSchema) -> None:
+        value = {'data': data.dict(), 'expires': time.time() + self.list_cache_ttl}
+        await self.list_cache.set(key, value, ttl=self.list_cache_ttl + self.list_cache_stale_ttl)
+
+    def _refresh_list_cache(self, key: str, stmt: Select, paginator: Paginator, params: Dict[str, Any]) -> None:
+        """在后台从主库刷新批量查询缓存"""
+
+        async def refresh(session: AsyncSession):
+            data = await self._fetch_list(session, stmt, paginator, params)
+            await self._set_list_cache(key, data)
+
+        self._refresh_cache(key, refresh)
+
+    def _refresh_cache(self, key: Hashable, refresh: Callable[[AsyncSession], Awaitable[None]]) -> None:
+        """在后台使用独立的主库会话刷新缓存,同一缓存键同时只刷新一次"""
+        if key in self._cache_tasks:
+            return
+
+        async def run():
+            try:
+                async with self._session_scope(self.session_factory) as session:
+                    await refresh(session)
+            except Exception:  # 刷新失败时继续使用旧数据
+                logger.exception('Failed to refresh cache of %s', self.model.__tablename__)
+
+        task = asyncio.ensure_future(run())
+        self._cache_tasks[key] = task
+        task.add_done_callback(lambda _: self._cache_tasks.pop(key, None))
+
+    @property
+    def _link_dialect(self) -> Callable:
+        async def dialect(session: AsyncSession = Depends(self.session_factory_read)) -> str:
+            return session.sync_session.get_bind().dialect.name
+
+        return dialect
+
+    @staticmethod
+    def _is_replica_session(session: AsyncSession) -> bool:
+        """会话是否连接只读从库,从库数据可能落后于主库,读取的数据不直接写入缓存"""
+        return bool(session.sync_session.info.get('replica'))
+
+    @staticmethod
+    async def _release_session(session: AsyncSession) -> None:
+        """读取完成后立即结束事务并归还数据库连接,不必等到响应发送后的依赖清理"""
+        if session.in_transaction():
+            await session.close()
+
+    @asynccontextmanager
+    async def _session_scope(self, session_factory: Callable[..., AsyncGenerator[AsyncSession, Any]] = None) -> \
+            AsyncGenerator[AsyncSession, None]:
+        """在请求依赖之外创建数据库会话"""
+        generator = (session_factory or self.session_factory)()
+        try:
+            yield await generator.__anext__()
+        finally:
+            await generator.aclose()
+
+    @property
+    def route_aggregate(self) -> Callable:
+
+        async def route(
+                request: Request,
+                aggregator: Aggregator = Depends(),
+                filter: self.schema_filter = Body(None),  # type: ignore
+                session: AsyncSession = Depends(self.session_factory_read),
+                stmt: Select = Depends(self._select_maker),
+        ):
+            if not await self.has_list_permission(request, None, filter):
+                return self.error_no_router_permission(request)
+            filter_data = await self.on_filter_pre(request, filter)
+            params = {}
+            if filter_data:
+                clauses, params = self._calc_filter(filter_data)
+                stmt = stmt.filter(*clauses)
+            key = None
+            if self.list_cache is not None:
+                key = await self._get_aggregate_cache_key(request, aggregator, filter_data)
+                value = await self.list_cache.get(key)
+                if value is not None:
+                    return self.make_response(BaseApiOut(data=AggregateSchema.construct(**value)))
+            dialect = session.sync_session.get_bind().dialect.name
+            stmt = self._get_aggregate_select(stmt, aggregator, dialect)
+            if stmt is None:
+                return self.error_data_handle(request)
+            result = await session.execute(stmt, params)
+            rows = result.all()
+            await self._release_session(session)
+            data = self._conv_aggregate_chart(rows, stmt, aggregator)
+            if key is not None and self._is_replica_session(session):
+                self._refresh_aggregate_cache(key, stmt, params, aggregator)
+            elif key is not None:
+                await self.list_cache.set(key, data.dict(), ttl=self.aggregate_cache_ttl)
+            return self.make_response(BaseApiOut(data=data))
+
+        return route
+
+    def _get_aggregate_select(self, stmt: Select, aggregator: Aggregator, dialect: str) -> Optional[Select]:
+        """构造聚合查询语句,字段或参数无效时返回None"""
+        dimensions = []
+        if aggregator.date_field:
+            insfield = self._list_fields_ins.get(aggregator.date_field)
+            bucket = None if insfield is None else self._calc_date_bucket(insfield, aggregator.date_bucket, dialect)
+            if bucket is None:
+                return None
+            dimensions.append(bucket.label(aggregator.date_field))
+        for name in aggregator.group_by:
+            insfield = self._list_fields_ins.get(name)
+            if insfield is None:
+                return None
+            dimensions.append(insfield.label(name))
+        metrics = []
+        for func_name, name in aggregator.metrics:
+            insfield = self._list_fields_ins.get(name) if name else None
+            if func_name not in ['count', 'sum', 'avg', 'min', 'max'] or (name and insfield is None) \
+                    or (insfield is None and func_name != 'count'):
+                return None
+            expr = getattr(func, func_name)(*([insfield] if insfield is not None else []))
+            metrics.append(expr.label(f'{func_name}_{name}' if name else func_name))
+        if not metrics:
+            return None
+        stmt = stmt.with_only_columns(*dimensions, *metrics, maintain_column_froms=True).order_by(None)
+        if dimensions:
+            keys = [dimension.element for dimension in dimensions]
+            stmt = stmt.group_by(*keys).order_by(*keys)
+        return stmt.limit(self.aggregate_max_groups + 1)
+
+    @staticmethod
+    def _calc_date_bucket(insfield: InstrumentedAttribute, bucket: str, dialect: str) -> Optional[Any]:
+        """按数据库方言返回日期分组表达式,结果为日期字符串. 按周分组时为ISO周: ISO年份-ISO周数, 例如: 2021-52"""
+        if dialect == 'sqlite' and bucket == 'week':  # SQLite strftime 没有ISO周格式, 按所在周的星期四计算
+            thursday = func.date(insfield, literal_column("'-3 days'"), literal_column("'weekday 4'"))
+            week = (cast(func.strftime(literal_column("'%j'"), thursday), Integer) - literal_column('1')) \
+                   / literal_column('7') + literal_column('1')
+            return func.printf(literal_column("'%s-%02d'"), func.strftime(literal_column("'%Y'"), thursday), week)
+        formats = {
+            'sqlite': {'day': '%Y-%m-%d', 'month': '%Y-%m'},
+            'mysql': {'day': '%Y-%m-%d', 'week': '%x-%v', 'month': '%Y-%m'},
+            'postgresql': {'day': 'YYYY-MM-DD', 'week': 'IYYY-IW', 'month': 'YYYY-MM'},
+        }
+        fmt = formats.get(dialect, {}).get(bucket)
+        if fmt is None:
+            return None
+        fmt = literal_column(f"'{fmt}'")  # 分组与查询字段的表达式需完全一致,不使用绑定参数
+        if dialect == 'sqlite':
+            return func.strftime(fmt, insfield)
+        elif dialect == 'mysql':
+            return func.date_format(insfield, fmt)
+        return func.to_char(insfield, fmt)
+
+    def _conv_aggregate_chart(self, rows: List[Row], stmt: Select, aggregator: Aggregator) -> AggregateSchema:
+        """将分组数据转换为ECharts配置: 第一个分组为x轴,其余分组及多个指标拆分为多个系列"""
+        truncated = len(rows) > self.aggregate_max_groups
+        rows = rows[:self.aggregate_max_groups]
+        names = [column.key for column in stmt.exported_columns]
+        dim_count = len(names) - len(aggregator.metrics)
+        metric_names = names[dim_count:]
+        data = AggregateSchema(dataset={'dimensions': names, 'source': [list(row) for row in rows]},
+                               truncated=truncated or None)
+        x_values = list(dict.fromkeys(row[0] for row in rows)) if dim_count else ['']
+        if aggregator.chart_type == 'pie':
+            data.tooltip = {'trigger': 'item'}
+            data.series = [{'name': metric_names[0], 'type': 'pie',
+                            'data': [{'name': row[0] if dim_count else metric_names[0], 'value': row[dim_count]}
+                                     for row in rows]}]
+            return data
+        x_index = {x: index for index, x in enumerate(x_values)}
+        series: Dict[str, List[Any]] = {}
+        for row in rows:
+            split = ' / '.join(str(value) for value in row[1:dim_count])
+            for index, metric in enumerate(metric_names):
+                name = f'{split} {metric}' if split and len(metric_names) > 1 else split or metric
+                values = series.setdefault(name, [None] * len(x_values))
+                values[x_index[row[0] if dim_count else '']] = row[dim_count + index]
+        data.xAxis = {'type': 'category', 'data': x_values}
+        data.yAxis = {'type': 'value'}
+        data.legend = {'data': list(series)}
+        data.tooltip = {'trigger': 'axis'}
+        data.series = [{'name': name, 'type': aggregator.chart_type, 'data': values} for name, values in series.items()]
+        return data
+
+    async def _get_aggregate_cache_key(self, request: Request, aggregator: Aggregator,
+                                       filter_data: Optional[Dict[str, Any]]) -> str:
+        tables = self._get_list_cache_tables()
+        signature = [tables, await table_generation.get(self.list_cache, *tables),
+                     await self.get_list_cache_scope(request),
+                     request.query_params.get('link_model'), request.query_params.get('link_item_id'),
+                     sorted(filter_data.items()) if filter_data else None, aggregator.__dict__]
+        digest = hashlib.md5(ujson.dumps(jsonable_encoder(signature)).encode()).hexdigest()
+        return f'{self.model.__tablename__}:aggregate:{digest}'
+
+    def _refresh_aggregate_cache(self, key: str, stmt: Select, params: Dict[str, Any], aggregator: Aggregator) -> None:
+        """在后台从主库刷新聚合查询缓存"""
+
+        async def refresh(session: AsyncSession):
+            result = await session.execute(stmt, params)
+            data = self._conv_aggregate_chart(result.all(), stmt, aggregator)
+            await self.list_cache.set(key, data.dict(), ttl=self.aggregate_cache_ttl)
+
+        self._refresh_cache(key, refresh)
+
+    @property
+    def route_list_explain(self) -> Callable:
+
+        async def route(
+                request: Request,
+                paginator: self.paginator = Depends(self.paginator),  # type: ignore
+                filter: self.schema_filter = Body(None),  # type: ignore
+                session: AsyncSession = Depends(self.session_factory_read),
                 stmt: Select = Depends(self._select_maker),
         ):
             if not await self.has_list_permission(request, paginator, filter):
                 return self.error_no_router_permission(request)
-            data = ItemListSchema(items=[])
-            page, perPage = paginator.page, paginator.perPage
             filter_data = await self.on_filter_pre(request, filter)
+            params = {}
             if filter_data:
-                stmt = stmt.filter(*self.calc_filter_clause(filter_data))
+                clauses, params = self._calc_filter(filter_data)
+                stmt = stmt.filter(*clauses)
+            list_stmt = self._get_list_select(stmt, paginator)
+            data = QueryPlanSchema(sql=compile_select(session, list_stmt, params),
+                                   plan=await explain_select(session, list_stmt, params))
+            if data.plan is not None:
+                dialect = session.sync_session.get_bind().dialect.name
+                data.full_scan = is_full_scan(dialect, data.plan, self.model.__tablename__)
             if paginator.show_total:
-                result = await session.execute(select(func.count('*')).select_from(stmt.subquery()))
-                data.total = result.scalar()
-            orderBy = self._calc_ordering(paginator.orderBy, paginator.orderDir)
+                count_stmt = select(func.count()).select_from(self._get_count_select(stmt).subquery())
+                data.count_sql = compile_select(session, count_stmt, params)
+                data.count_plan = await explain_select(session, count_stmt, params)
+            return BaseApiOut(data=data)
+
+        return route
+
+    def _get_list_select(self, stmt: Select, paginator: Paginator) -> Select:
+        """返回批量查询实际执行的分页查询语句"""
+        if self.list_keyset and (paginator.cursor or paginator.page == 1):
+            order, clause, _ = self._calc_keyset_clause(paginator)
+            if clause is not None:
+                stmt = stmt.where(clause)
+            return stmt.order_by(*order).limit(paginator.perPage + 1)
+        orderBy = self._calc_list_ordering(paginator)
+        if orderBy:
+            stmt = stmt.order_by(*orderBy)
+        return stmt.limit(paginator.perPage).offset((paginator.page - 1) * paginator.perPage)
+
+    async def get_query_advices(self, session: AsyncSession = None) -> List[QueryAdvice]:
+        """检查批量查询相关字段的索引及执行计划,返回缺少索引或全表扫描的字段及优化建议"""
+        if session is None:
+            async with self._session_scope() as session:
+                return await self.get_query_advices(session)
+        return await QueryAdvisor(self).advise(session)
+
+    def _get_count_select(self, stmt: Select) -> Select:
+        return stmt.with_only_columns(self.pk, maintain_column_froms=True).order_by(None)
+
+    async def _fetch_total(self, session: AsyncSession, stmt: Select, data: ItemListSchema,
+                           params: Dict[str, Any] = None) -> None:
+        strategy = self.count_strategy
+        if strategy == 'estimated':
+            if stmt.whereclause is None and stmt.get_final_froms() == [self.model.__table__]:
+                data.total = await self._fetch_total_estimated(session)
+                if data.total is not None:
+                    return
+            strategy = 'capped'
+        stmt = self._get_count_select(stmt)
+        if strategy == 'capped':
+            stmt = stmt.limit(self.count_capped_max + 1)
+        result = await session.execute(select(func.count()).select_from(stmt.subquery()), params)
+        data.total = result.scalar()
+        if strategy == 'capped' and data.total > self.count_capped_max:
+            data.total = self.count_capped_max
+            data.total_capped = True
+
+    async def _fetch_total_estimated(self, session: AsyncSession) -> Optional[int]:
+        """根据数据库统计信息估算数据表总量,不支持时返回None"""
+        dialect = session.sync_session.get_bind().dialect.name
+        params = {'table': self.model.__tablename__}
+        if dialect == 'sqlite':
+            result = await session.execute(text("SELECT name FROM sqlite_master WHERE name = 'sqlite_stat1'"))
+            if result.scalar() is None:
+                return None
+            sql = 'SELECT stat FROM sqlite_stat1 WHERE tbl = :table LIMIT 1'
+        elif dialect == 'postgresql':
+            sql = 'SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)'
+        elif dialect == 'mysql':
+            sql = 'SELECT table_rows FROM information_schema.tables ' \
+                  'WHERE table_schema = DATABASE() AND table_name = :table'
+        else:
+            return None
+        try:
+            result = await session.execute(text(sql), params)
+        except DBAPIError:
+            return None
+        stat = result.scalar()
+        if stat is None:
+            return None
+        total = int(str(stat).split(' ')[0])
+        return total if total >= 0 else None
+
+    async def _fetch_keyset_items(self, session: AsyncSession, stmt: Select, paginator: Paginator,
+                                  data: ItemListSchema, params: Dict[str, Any] = None) -> List[BaseModel]:
+        order, clause, is_prev = self._calc_keyset_clause(paginator)
+        if clause is not None:
+            stmt = stmt.where(clause)
+        result = await session.execute(stmt.order_by(*order).limit(paginator.perPage + 1), params)
+        rows = result.all()
+        has_more = len(rows) > paginator.perPage
+        rows = rows[:paginator.perPage]
+        if is_prev:
+            rows.reverse()
+        if rows:
+            if has_more or is_prev:
+                data.next_cursor = self._calc_keyset_cursor(paginator, rows[-1])
+            if clause is not None and (has_more or not is_prev):
+                data.prev_cursor = self._calc_keyset_cursor(paginator, rows[0], is_prev=True)
+        return self._conv_rows(rows, self._get_list_schema(stmt))
+
+    @property
+    def route_export(self) -> Callable:
+
+        async def route(
+                request: Request,
+                format: str = Query('csv', regex='^(csv|ndjson)$', description='csv or ndjson'),
+                orderBy: str = None,
+                orderDir: str = 'asc',
+                filter: self.schema_filter = Body(None),  # type: ignore
+                stmt: Select = Depends(self.get_select),
+                link_clause: Union[LinkClause, ClauseElement, None] = Depends(self.get_link_clause),
+        ):
+            # 不使用依赖会话的_select_maker: 请求依赖的会话会在整个流式响应期间占用, 与响应体的会话同时持有
+            if not await self.has_list_permission(request, None, filter):
+                return self.error_no_router_permission(request)
+            filter_data = await self.on_filter_pre(request, filter)
+            params = {}
+            if filter_data:
+                clauses, params = self._calc_filter(filter_data)
+                stmt = stmt.filter(*clauses)
+            orderBy = self._calc_ordering(orderBy, orderDir)
             if orderBy:
                 stmt = stmt.order_by(*orderBy)
-            result = await session.execute(stmt.limit(perPage).offset((page - 1) * perPage))
-            data.items = result.all()
-            data.items = self.parser.conv_row_to_dict(data.items)
-            data.items = [self.schema_list.parse_obj(item) for item in data.items] if data.items else []
-            data.query = request.query_params
-            data.filter = filter_data
-            return BaseApiOut(data=data)
+            keys = self.parser.get_select_keys(stmt)
+            encoder = self._export_encode_csv if format == 'csv' else self._export_encode_ndjson
+
+            async def content():
+                # 会话由响应体生成器持有: 请求依赖在响应发送前或发送后清理, 均不能用于流式读取
+                async with self._session_scope(self.session_factory_read) as session:
+                    select_stmt = stmt
+                    if link_clause is not None:
+                        dialect = session.sync_session.get_bind().dialect.name
+                        select_stmt = self.calc_link_select(select_stmt, link_clause, dialect)
+                    result = await session.stream(select_stmt, params)
+                    try:
+                        if format == 'csv':
+                            yield encoder(keys, [keys])
+                        async for rows in result.partitions(self.export_chunk_size):
+                            yield encoder(keys, rows)
+                    finally:
+                        await result.close()
+
+            media_type = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+            filename = f'{self.model.__tablename__}.{format}'
+            return StreamingResponse(content(), media_type=media_type,
+                                     headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
         return route
 
+    @staticmethod
+    def _export_encode_csv(keys: List[str], rows: List[Any]) -> str:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue()
+
+    @staticmethod
+    def _export_encode_ndjson(keys: List[str], rows: List[Any]) -> str:
+        return ''.join(ujson.dumps({key: val if val is None or isinstance(val, (str, int, float)) else
+                                    pydantic_encoder(val) for key, val in zip(keys, row)}) + '\n' for row in rows)
+
     @property
     def route_create(self) -> Callable:
         async def route(request: Request,
@@ -244,44 +1202,230 @@ class SQLModelCrud(BaseCrud, SQLModelSelector):
             values = [await self.on_create_pre(request, value) for value in data]
             if not values:
                 return self.error_data_handle(request)
-            stmt = insert(self.model).values(values)
             try:
-                result = await session.execute(stmt)
-                if result.rowcount:  # type: ignore
+                if is_bulk:
+                    count, ids = await self._create_items(session, values)
+                else:
+                    result = await session.execute(insert(self.model).values(values[0]))
+                    count = result.rowcount
+                if count:  # type: ignore
                     await session.commit()
+                    await self.clear_cache([value[self.pk_name] for value in values if self.pk_name in value])
                     if is_bulk:
-                        return BaseApiOut(data=result.rowcount)  # type: ignore
+                        if ids is None:  # 数据库不支持 RETURNING 时不返回主键列表
+                            return self.make_response(BaseApiOut(data=count))
+                        return self.make_response(BaseApiOut(data=count, ids=ids))  # type: ignore
                     else:
                         data = values[0]
-                        data[self.pk_name] = result.lastrowid  # type: ignore
+                        data[self.pk_name] = result.inserted_primary_key[0]  # type: ignore
                         data = self.model.parse_obj(data)
-                        return BaseApiOut(data=data)
+                        return self.make_response(BaseApiOut(data=data))
             except Exception:
                 return self.error_key_exists(request)
 
         return route
 
+    async def _create_items(self, session: AsyncSession, values: List[Dict[str, Any]]) -> Tuple[
+        int, Optional[List[Any]]]:
+        """分批插入数据,数据库支持 RETURNING 时返回新增数据的主键列表"""
+        table = self.model.__table__
+        dialect = session.sync_session.get_bind().dialect
+        # SQLAlchemy 2.0 使用 insert_returning, 1.4 中 SQLite 方言不支持 RETURNING
+        returning = getattr(dialect, 'insert_returning', getattr(dialect, 'full_returning', False))
+        count, ids = 0, [] if returning else None
+        for _, group in itertools.groupby(values, key=lambda value: tuple(value)):
+            for chunk in chunks(list(group), self.bulk_chunk_size):
+                if returning:
+                    result = await session.execute(insert(table).values(chunk).returning(table.c[self.pk_name]))
+                    chunk_ids = result.scalars().all()
+                    ids.extend(chunk_ids)
+                    count += len(chunk_ids)
+                else:
+                    result = await session.execute(insert(table), chunk)
+                    count += result.rowcount
+        return count, ids
+
+    @property
+    def route_upsert(self) -> Callable:
+        async def route(request: Request,
+                        data: Union[self.schema_create, List[self.schema_create]] = Body(...),  # type: ignore
+                        session: AsyncSession = Depends(self.session_factory)
+                        ):
+            if not await self.has_create_permission(request, data):
+                return self.error_no_router_permission(request)
+            if not isinstance(data, list):
+                data = [data]
+            for item in data:  # 更新权限按单条数据检查
+                if not await self.has_update_permission(request, None, item):
+                    return self.error_no_router_permission(request)
+            values = [await self.on_create_pre(request, value) for value in data]
+            if not values:
+                return self.error_data_handle(request)
+            try:
+                result = await self._upsert_items(session, values)
+            except IntegrityError:  # 非冲突字段的唯一约束冲突
+                return self.error_key_exists(request)
+            if result is None:
+                return self.error_data_handle(request)
+            await session.commit()
+            if self.upsert_conflict_fields:
+                await self.clear_cache()
+            else:
+                await self.clear_cache([value[self.pk_name] for value in values if self.pk_name in value])
+            return self.make_response(BaseApiOut(data=result))
+
+        return route
+
+    async def _upsert_items(self, session: AsyncSession, values: List[Dict[str, Any]]) -> Optional[
+        UpsertResultSchema]:
+        """分批执行 INSERT ... ON CONFLICT DO UPDATE, 支持 SQLite 及 PostgreSQL.
+        同一批次中冲突字段值重复的数据只保留最后一条, 新增及更新数量按冲突字段值统计"""
+        dialect = session.sync_session.get_bind().dialect.name
+        if dialect not in ['sqlite', 'postgresql']:
+            return None
+        dialect_insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        table = self.model.__table__
+        conflict_cols = [self.parser.get_column(field) for field in self.upsert_conflict_fields] or [
+            table.c[self.pk_name]]
+        conflict_keys = [col.key for col in conflict_cols]
+        update_keys = {self.parser.get_column(field).key for field in self.upsert_update_fields}
+        result = UpsertResultSchema()
+        for keys, group in itertools.groupby(values, key=lambda value: tuple(value)):
+            if not set(conflict_keys).issubset(keys):  # 缺少冲突字段,直接新增
+                for chunk in chunks(list(group), self.bulk_chunk_size):
+                    res = await session.execute(insert(table), chunk)
+                    result.inserted += res.rowcount
+                continue
+            group = list({tuple(value[key] for key in conflict_keys): value for value in group}.values())
+            stmt = dialect_insert(table)
+            set_ = {key: stmt.excluded[key] for key in keys if
+                    key not in conflict_keys and (not update_keys or key in update_keys)}
+            for chunk in chunks(group, self.bulk_chunk_size):
+                if dialect == 'postgresql':
+                    chunk_stmt = stmt.values(chunk)
+                    if set_:
+                        chunk_stmt = chunk_stmt.on_conflict_do_update(index_elements=conflict_keys, set_=set_)
+                    else:
+                        chunk_stmt = chunk_stmt.on_conflict_do_nothing(index_elements=conflict_keys)
+                    res = await session.execute(chunk_stmt.returning(literal_column('xmax = 0')))
+                    inserted = res.scalars().all()
+                    result.inserted += sum(inserted)
+                    result.updated += len(inserted) - sum(inserted)
+                    continue
+                # SQLite 不支持 RETURNING, 先插入不存在的数据, 未插入的数据即为已存在的数据, 再逐条更新
+                res = await session.execute(stmt.on_conflict_do_nothing(index_elements=conflict_keys), chunk)
+                result.inserted += res.rowcount
+                if not set_:
+                    continue
+                update_stmt = update(table).where(
+                    *[col == bindparam(f'_key_{col.key}') for col in conflict_cols]
+                ).values({key: bindparam(f'_set_{key}') for key in set_})
+                params = [{**{f'_key_{key}': value[key] for key in conflict_keys},
+                           **{f'_set_{key}': value[key] for key in set_}} for value in chunk]
+                await session.execute(update_stmt, params)
+                result.updated += len(chunk) - res.rowcount
+        return result
+
     @property
     def route_read(self) -> Callable:
         async def route(
                 request: Request,
                 item_id: List[str] = Depends(parser_item_id),
-                session: AsyncSession = Depends(self.session_factory),
+                session: AsyncSession = Depends(self.session_factory_read),
                 stmt: Select = Depends(self.get_select)
         ):
             if not await self.has_read_permission(request, item_id):
                 return self.error_no_router_permission(request)
-            result = await session.execute(stmt.where(self.pk.in_(item_id)))
-            items = result.all()
-            items = self.parser.conv_row_to_dict(items)
+            items = await self._read_by_ids(session, stmt, item_id) or None
+            await self._release_session(session)
             if items:
-                items = [self.schema_read.parse_obj(item) for item in items]
                 if len(items) == 1:
                     items = items[0]
-            return BaseApiOut(data=items)
+            return self.make_response(BaseApiOut(data=items))
+
+        return route
+
+    @property
+    def route_read_items(self) -> Callable:
+        async def route(
+                request: Request,
+                item_id: List[str] = Body(..., embed=True, min_items=1),
+                session: AsyncSession = Depends(self.session_factory_read),
+                stmt: Select = Depends(self.get_select)
+        ):
+            item_id = list(set(item_id))
+            if not await self.has_read_permission(request, item_id):
+                return self.error_no_router_permission(request)
+            items = await self._read_by_ids(session, stmt, item_id)
+            await self._release_session(session)
+            return self.make_response(BaseApiOut(data=items))
 
         return route
 
+    async def _read_by_ids(self, session: AsyncSession, stmt: Select, item_id: List[str]) -> List[BaseModel]:
+        items = []
+        if self.read_cache is not None:
+            prefix = await self._get_read_cache_prefix()
+            missing = []
+            for pk in item_id:
+                value = await self.read_cache.get(f'{prefix}{pk}')
+                if value is None:
+                    missing.append(pk)
+                else:
+                    items.append(self.schema_read.construct(**value))
+            item_id = missing
+        cacheable = self.read_cache is not None and not self._is_replica_session(session)
+        for chunk in chunks(item_id, self.bulk_chunk_size):
+            result = await session.execute(stmt.where(self.pk.in_(chunk)))
+            rows = self._conv_rows(result.all(), self.schema_read)
+            if cacheable:
+                await self._set_read_cache(prefix, rows)
+            items.extend(rows)
+        if self.read_cache is not None and item_id and not cacheable:
+            self._refresh_read_cache(prefix, stmt, item_id)
+        return items
+
+    async def _set_read_cache(self, prefix: str, items: List[BaseModel]) -> None:
+        for item in items:
+            await self.read_cache.set(f'{prefix}{getattr(item, self.pk_name)}', item.dict())
+
+    def _refresh_read_cache(self, prefix: str, stmt: Select, item_id: List[str]) -> None:
+        """从库未命中缓存的数据在后台从主库读取并写入缓存"""
+
+        async def refresh(session: AsyncSession):
+            for chunk in chunks(item_id, self.bulk_chunk_size):
+                result = await session.execute(stmt.where(self.pk.in_(chunk)))
+                await self._set_read_cache(prefix, self._conv_rows(result.all(), self.schema_read))
+
+        self._refresh_cache(('read', prefix, *sorted(item_id)), refresh)
+
+    async def _get_read_cache_prefix(self) -> str:
+        """读取数据缓存键前缀. 读取关联模型字段时包含关联表的版本号, 关联表写入后缓存失效"""
+        tables = sorted({insfield.class_.__tablename__ for insfield in self._list_fields_ins.values()
+                         if hasattr(insfield, 'class_') and hasattr(insfield.class_, '__tablename__')}
+                        - {self.model.__tablename__})
+        if not tables:
+            return f'{self.model.__tablename__}:'
+        generations = await table_generation.get(self.read_cache, *tables)
+        return f'{self.model.__tablename__}:{":".join(map(str, generations))}:'
+
+    async def clear_cache(self, item_id: Optional[List[Any]] = None) -> None:
+        """数据写入后调用,更新数据表版本号使批量查询缓存失效,并清除读取数据缓存"""
+        if self.list_cache is not None:
+            table_generation.register(self.list_cache)
+        await table_generation.bump(self.model.__tablename__)
+        await self.clear_read_cache(item_id)
+
+    async def clear_read_cache(self, item_id: Optional[List[Any]] = None) -> None:
+        """清除读取数据缓存, item_id为None时清除全部缓存"""
+        if self.read_cache is None:
+            return
+        if item_id is None:
+            await self.read_cache.clear()
+        elif item_id:
+            prefix = await self._get_read_cache_prefix()
+            await self.read_cache.delete(*[f'{prefix}{pk}' for pk in item_id])
+
     @property
     def route_update(self) -> Callable:
         async def route(request: Request,
@@ -291,18 +1435,92 @@ class SQLModelCrud(BaseCrud, SQLModelSelector):
                         ):
             if not await self.has_update_permission(request, item_id, data):
                 return self.error_no_router_permission(request)
-            stmt = update(self.model).where(self.pk.in_(item_id))
             data = await self.on_update_pre(request, data)
             if not data:
                 return self.error_data_handle(request)
-            stmt = stmt.values(data)
-            result = await session.execute(stmt)
-            if result.rowcount:  # type: ignore
+            count = await self._update_by_ids(session, item_id, data)
+            if count:
+                await session.commit()
+                await self.clear_cache(item_id)
+                return self.make_response(BaseApiOut(data=count))
+
+        return route
+
+    @property
+    def route_update_items(self) -> Callable:
+        async def route(request: Request,
+                        item_id: List[str] = Body(..., min_items=1),
+                        data: self.schema_update = Body(...),  # type: ignore
+                        session: AsyncSession = Depends(self.session_factory)
+                        ):
+            item_id = list(set(item_id))
+            if not await self.has_update_permission(request, item_id, data):
+                return self.error_no_router_permission(request)
+            data = await self.on_update_pre(request, data)
+            if not data:
+                return self.error_data_handle(request)
+            count = await self._update_by_ids(session, item_id, data)
+            if count:
                 await session.commit()
-                return BaseApiOut(data=result.rowcount)  # type: ignore
+                await self.clear_cache(item_id)
+            return self.make_response(BaseApiOut(data=count))
 
         return route
 
+    async def _update_by_ids(self, session: AsyncSession, item_id: List[str], data: Dict[str, Any]) -> int:
+        count = 0
+        for chunk in chunks(item_id, self.bulk_chunk_size):
+            result = await session.execute(update(self.model).where(self.pk.in_(chunk)).values(data))
+            count += result.rowcount
+        return count
+
+    def _create_schema_bulk_update(self) -> Type[BaseModel]:
+        modelfield = self.parser.get_modelfield(self.pk, deepcopy=True)
+        modelfield.required, modelfield.allow_none = True, False
+        modelfields = [field for field in smart_deepcopy(self.schema_update.__fields__).values()
+                       if field.name != self.pk_name]
+        return schema_create_by_modelfield(self.schema_name_prefix + 'BulkUpdate', [modelfield, *modelfields])
+
+    @property
+    def route_bulk_update(self) -> Callable:
+        schema_bulk_update = self._create_schema_bulk_update()
+
+        async def route(request: Request,
+                        data: List[schema_bulk_update] = Body(...),  # type: ignore
+                        session: AsyncSession = Depends(self.session_factory)
+                        ):
+            item_id = [str(getattr(item, self.pk_name)) for item in data]
+            for pk, item in zip(item_id, data):  # 每条数据的更新内容不同, 按单条数据检查权限
+                if not await self.has_update_permission(request, [pk], item):
+                    return self.error_no_router_permission(request)
+            values = [await self.on_update_pre(request, item) for item in data]
+            count = await self._update_items(session, values)
+            if count:
+                await session.commit()
+                await self.clear_cache(item_id)
+            return self.make_response(BaseApiOut(data=count))
+
+        return route
+
+    async def _update_items(self, session: AsyncSession, values: List[Dict[str, Any]]) -> int:
+        """按更新字段分组,每组使用 executemany 批量执行不同数据的更新"""
+        table = self.model.__table__
+        groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+        for value in values:
+            keys = tuple(sorted(key for key in value if key != self.pk_name))
+            if keys:
+                groups.setdefault(keys, []).append(value)
+        count = 0
+        for keys, group in groups.items():
+            stmt = update(table).where(table.c[self.pk_name] == bindparam('_pk')).values(
+                {key: bindparam(f'_value_{i}') for i, key in enumerate(keys)})
+            for chunk in chunks(group, self.bulk_chunk_size):
+                params = [{'_pk': value[self.pk_name], **{f'_value_{i}': value[key] for i, key in enumerate(keys)}}
+                          for value in chunk]
+                result = await session.execute(stmt, params)
+                count += result.rowcount
+        return count
+
     @property
     def route_delete(self) -> Callable:
         async def route(
@@ -312,10 +1530,35 @@ class SQLModelCrud(BaseCrud, SQLModelSelector):
         ):
             if not await self.has_delete_permission(request, item_id):
                 return self.error_no_router_permission(request)
-            stmt = delete(self.model).where(self.pk.in_(item_id))
-            result = await session.execute(stmt)
-            if result.rowcount:  # type: ignore
+            count = await self._delete_by_ids(session, item_id)
+            if count:
                 await session.commit()
-            return BaseApiOut(data=result.rowcount)  # type: ignore
+                await self.clear_cache(item_id)
+            return self.make_response(BaseApiOut(data=count))
 
         return route
+
+    @property
+    def route_delete_items(self) -> Callable:
+        async def route(
+                request: Request,
+                item_id: List[str] = Body(..., embed=True, min_items=1),
+                session: AsyncSession = Depends(self.session_factory)
+        ):
+            item_id = list(set(item_id))
+            if not await self.has_delete_permission(request, item_id):
+                return self.error_no_router_permission(request)
+            count = await self._delete_by_ids(session, item_id)
+            if count:
+                await session.commit()
+                await self.clear_cache(item_id)
+            return self.make_response(BaseApiOut(data=count))
+
+        return route
+
+    async def _delete_by_ids(self, session: AsyncSession, item_id: List[str]) -> int:
+        count = 0
+        for chunk in chunks(item_id, self.bulk_chunk_size):
+            result = await session.execute(delete(self.model).where(self.pk.in_(chunk)))
+            count += result.rowcount
+        return count
@@ -0,0 +1,138 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from sqlalchemy import Column, Table, text, PrimaryKeyConstraint, UniqueConstraint
+from sqlalchemy.future import select
+from sqlalchemy.orm import InstrumentedAttribute
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlmodel.sql.expression import Select
+
+from .schema import QueryAdvice
+
+if TYPE_CHECKING:
+    from ._sqlmodel import SQLModelCrud
+
+_explain_prefix: Dict[str, str] = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'postgresql': 'EXPLAIN ',
+    'mysql': 'EXPLAIN ',
+}
+
+
+def compile_select(session: AsyncSession, stmt: Select, params: Dict[str, Any] = None) -> str:
+    """将查询语句及绑定参数编译为当前数据库的SQL"""
+    if params:
+        stmt = stmt.params(params)
+    dialect = session.sync_session.get_bind().dialect
+    return str(stmt.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+
+
+async def explain_select(session: AsyncSession, stmt: Select, params: Dict[str, Any] = None) -> Optional[List[str]]:
+    """返回查询语句的执行计划,不支持的数据库返回None"""
+    dialect = session.sync_session.get_bind().dialect
+    prefix = _explain_prefix.get(dialect.name)
+    if prefix is None:
+        return None
+    sql = compile_select(session, stmt, params)
+    result = await session.execute(text(prefix + sql.replace(':', r'\:')))
+    if dialect.name == 'sqlite':
+        return [row[-1] for row in result]
+    elif dialect.name == 'postgresql':
+        return [row[0] for row in result]
+    return [', '.join(f'{key}={val}' for key, val in row._mapping.items()) for row in result]
+
+
+def is_full_scan(dialect: str, plan: List[str], table: str) -> bool:
+    """执行计划中是否存在对数据表的全表扫描"""
+    if dialect == 'sqlite':
+        pattern = re.compile(rf'^SCAN (TABLE )?{re.escape(table)}\b(?!.*INDEX)')
+    elif dialect == 'postgresql':
+        pattern = re.compile(rf'Seq Scan on {re.escape(table)}\b')
+    else:
+        pattern = re.compile(rf'table={re.escape(table)}, .*type=ALL\b')
+    return any(pattern.search(line) for line in plan)
+
+
+class QueryAdvisor:
+    """检查批量查询的过滤,排序,搜索及关联字段是否存在索引,并通过执行计划找出全表扫描"""
+
+    def __init__(self, crud: "SQLModelCrud"):
+        self.crud = crud
+
+    def get_columns(self) -> List[Tuple[str, Column]]:
+        """返回需要检查的字段及其用途: filter, ordering, search, link"""
+        crud, parser = self.crud, self.crud.parser
+        columns = []
+        filter_fields = getattr(crud, 'list_filter', None) or list(crud._list_fields_ins.values())
+        search_fields = parser.filter_insfield(crud.search_fields)
+        for usage, fields in [('filter', [field for field in parser.filter_insfield(filter_fields)
+                                          if field not in search_fields]),
+                              ('ordering', parser.filter_insfield(crud.ordering)),
+                              ('search', search_fields)]:
+            for insfield in fields:
+                column = parser.get_column(insfield) if isinstance(insfield, InstrumentedAttribute) else None
+                if column is not None:
+                    columns.append((usage, column))
+        for table, _, link_col in crud.link_models.values():
+            columns.append(('link', link_col))
+        return columns
+
+    @staticmethod
+    def is_indexed(column: Column) -> bool:
+        """是否存在以该字段开头的索引"""
+        table: Table = column.table
+        for index in table.indexes:
+            if index.columns.values()[0] is column:
+                return True
+        for constraint in table.constraints:
+            if isinstance(constraint, (PrimaryKeyConstraint, UniqueConstraint)) and constraint.columns \
+                    and constraint.columns.values()[0] is column:
+                return True
+        return False
+
+    def get_suggestion(self, usage: str, column: Column) -> str:
+        if usage == 'search':
+            return 'search_fulltext = True'
+        return f'CREATE INDEX ix_{column.table.name}_{column.name} ON {column.table.name} ({column.name})'
+
+    async def get_select(self, session: AsyncSession, usage: str, column: Column) -> Optional[Select]:
+        """根据字段用途构造具有代表性的查询语句, 数据表为空时返回None"""
+        result = await session.execute(select(column).where(column.isnot(None)).limit(1))
+        value = result.scalar()
+        if value is None:
+            return None
+        crud = self.crud
+        if usage == 'link':
+            return select(*column.table.primary_key.columns).where(column == value)
+        stmt = select(*crud._list_fields_ins.values())
+        if crud._list_joins:
+            stmt = stmt.select_from(crud._get_list_from())
+        if usage == 'ordering':
+            return stmt.order_by(column.desc()).limit(crud.list_per_page_max or 10)
+        if usage == 'search':
+            if crud._search_engine:
+                name = crud.parser.get_name(crud.model.__dict__[column.key])
+                clauses, params = crud.calc_filter_params({name: f'[~]{value}'})
+                return stmt.where(*clauses).params(params)
+            return stmt.where(column.like(f'%{value}%'))
+        return stmt.where(column == value)
+
+    async def advise(self, session: AsyncSession) -> List[QueryAdvice]:
+        """返回存在问题的字段: 缺少索引或执行计划为全表扫描"""
+        dialect = session.sync_session.get_bind().dialect.name
+        advices = []
+        for usage, column in self.get_columns():
+            advice = QueryAdvice(table=column.table.name, column=column.name, usage=usage,
+                                 indexed=self.is_indexed(column))
+            stmt = await self.get_select(session, usage, column)
+            plan = stmt is not None and await explain_select(session, stmt)
+            if plan:
+                advice.plan = plan
+                advice.full_scan = is_full_scan(dialect, plan, column.table.name)
+            if usage == 'search':  # like '%关键字%' 无法使用普通索引
+                advice.indexed = bool(self.crud._search_engine)
+            if not advice.indexed:
+                advice.suggestion = self.get_suggestion(usage, column)
+            if not advice.indexed or advice.full_scan:
+                advices.append(advice)
+        return advices
@@ -1,12 +1,15 @@
 from typing import Any, Callable, List, Type, Union, Optional
 
 from fastapi import APIRouter, Depends
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
 from starlette import status
 from starlette.exceptions import HTTPException
 from starlette.requests import Request
+from starlette.responses import StreamingResponse, JSONResponse
 
-from .schema import BaseApiOut, ItemListSchema, CrudEnum, Paginator
+from .schema import BaseApiOut, ItemListSchema, CrudEnum, Paginator, BaseApiJSONResponse, UpsertResultSchema, \
+    QueryPlanSchema, AggregateSchema
 from .utils import schema_create_by_schema, paginator_factory
 
 
@@ -40,6 +43,8 @@ class BaseCrud(RouterMixin):
     schema_update: Type[BaseModel] = None
     pk_name: str = 'id'
     list_per_page_max: int = None
+    response_raw: bool = False  # 直接返回预编码响应,跳过response_model的重复校验
+    list_explain: bool = False  # 注册批量查询执行计划调试路由,仅在调试时开启
 
     def __init__(self, schema_model: Type[BaseModel], router: APIRouter = None):
         self.paginator: Type[Paginator] = Paginator
@@ -67,7 +72,10 @@ class BaseCrud(RouterMixin):
                       depends_read: List[Depends] = None,
                       depends_create: List[Depends] = None,
                       depends_update: List[Depends] = None,
-                      depends_delete: List[Depends] = None
+                      depends_delete: List[Depends] = None,
+                      depends_export: List[Depends] = None,
+                      depends_upsert: List[Depends] = None,
+                      depends_bulk_update: List[Depends] = None
                       ) -> "BaseCrud":
         self.schema_list = schema_list or self.schema_list or self.schema_model
         self.schema_filter = schema_filter or self.schema_filter or schema_create_by_schema(
@@ -117,12 +125,97 @@ class BaseCrud(RouterMixin):
             dependencies=depends_delete,
             name=CrudEnum.delete.value
         )
+        # 扩展路由只在子类实现时注册, 只实现了基本路由的子类保持不变
+        if self._has_route('route_export'):
+            self.router.add_api_route(
+                "/export",
+                self.route_export,
+                methods=["POST"],
+                response_class=StreamingResponse,
+                dependencies=depends_export,
+                name=CrudEnum.export.value
+            )
+        if self._has_route('route_upsert'):
+            self.router.add_api_route(
+                "/upsert",
+                self.route_upsert,
+                methods=["POST"],
+                response_model=BaseApiOut[UpsertResultSchema],
+                dependencies=depends_upsert,
+                name=CrudEnum.upsert.value
+            )
+        if self._has_route('route_bulk_update'):
+            self.router.add_api_route(
+                "/item",
+                self.route_bulk_update,
+                methods=["PUT"],
+                response_model=BaseApiOut[int],
+                dependencies=depends_bulk_update,
+                name=CrudEnum.bulk_update.value
+            )
+        if self._has_route('route_read_items'):
+            self.router.add_api_route(
+                "/items/read",
+                self.route_read_items,
+                methods=["POST"],
+                response_model=BaseApiOut[List[self.schema_read]],
+                dependencies=depends_read,
+                name=CrudEnum.read_items.value
+            )
+        if self._has_route('route_update_items'):
+            self.router.add_api_route(
+                "/items/update",
+                self.route_update_items,
+                methods=["POST"],
+                response_model=BaseApiOut[int],
+                dependencies=depends_update,
+                name=CrudEnum.update_items.value
+            )
+        if self._has_route('route_delete_items'):
+            self.router.add_api_route(
+                "/items/delete",
+                self.route_delete_items,
+                methods=["POST"],
+                response_model=BaseApiOut[int],
+                dependencies=depends_delete,
+                name=CrudEnum.delete_items.value
+            )
+        if self._has_route('route_aggregate'):
+            self.router.add_api_route(
+                "/aggregate",
+                self.route_aggregate,
+                methods=["POST"],
+                response_model=BaseApiOut[AggregateSchema],
+                dependencies=depends_list,
+                name=CrudEnum.aggregate.value
+            )
+        if self.list_explain and self._has_route('route_list_explain'):
+            self.router.add_api_route(
+                "/list/explain",
+                self.route_list_explain,
+                methods=["POST"],
+                response_model=BaseApiOut[QueryPlanSchema],
+                dependencies=depends_list,
+                name=CrudEnum.list_explain.value
+            )
         return self
 
+    def _has_route(self, name: str) -> bool:
+        """子类是否重写了路由函数属性"""
+        return getattr(type(self), name) is not getattr(BaseCrud, name)
+
     @property
     def route_list(self) -> Callable[..., Any]:
         raise NotImplementedError
 
+    @property
+    def route_list_explain(self) -> Callable[..., Any]:
+        raise NotImplementedError
+
+    @property
+    def route_aggregate(self) -> Callable[..., Any]:
+        raise NotImplementedError
+
     @property
     def route_read(self) -> Callable[..., Any]:
         raise NotImplementedError
@@ -139,6 +232,30 @@ class BaseCrud(RouterMixin):
     def route_delete(self) -> Callable[..., Any]:
         raise NotImplementedError
 
+    @property
+    def route_export(self) -> Callable[..., Any]:
+        raise NotImplementedError
+
+    @property
+    def route_upsert(self) -> Callable[..., Any]:
+        raise NotImplementedError
+
+    @property
+    def route_bulk_update(self) -> Callable[..., Any]:
+        raise NotImplementedError
+
+    @property
+    def route_read_items(self) -> Callable[..., Any]:
+        raise NotImplementedError
+
+    @property
+    def route_update_items(self) -> Callable[..., Any]:
+        raise NotImplementedError
+
+    @property
+    def route_delete_items(self) -> Callable[..., Any]:
+        raise NotImplementedError
+
     async def has_list_permission(self, request: Request, paginator: Optional[Paginator], filter: Optional[BaseModel],
                                   **kwargs) -> bool:
         return True
@@ -156,6 +273,15 @@ class BaseCrud(RouterMixin):
     async def has_delete_permission(self, request: Request, item_id: Optional[List[str]], **kwargs) -> bool:
         return True
 
+    def make_response(self, result: BaseApiOut, response_model: Type[BaseModel] = None) -> Union[
+        BaseApiOut, JSONResponse]:
+        """response_model: 与路由注册的response_model不同时指定, 按该数据模型校验并编码后直接返回"""
+        if self.response_raw:
+            return BaseApiJSONResponse(result)
+        if response_model is not None:
+            return JSONResponse(jsonable_encoder(response_model.parse_obj(result.dict(by_alias=True))))
+        return result
+
     def error_key_exists(self, request: Request):
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Key already exists")
 
@@ -1,8 +1,16 @@
 from enum import Enum
 from typing import Dict, TypeVar, Optional, Generic, List, Any, Union
 import ujson
+from fastapi import Query
 from pydantic import BaseModel, Extra
 from pydantic.generics import GenericModel
+from pydantic.json import pydantic_encoder
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 _T = TypeVar('_T')
 
@@ -25,8 +33,59 @@ class ItemListSchema(GenericModel, Generic[_T], BaseApiSchema):
     """数据查询返回格式"""
     items: List[_T]  # 数据列表
     total: int = None  # 数据总量
+    total_capped: bool = None  # 数据总量是否超出统计上限
     query: Dict[str, Any] = None
     filter: Dict[str, Any] = None
+    next_cursor: str = None  # 下一页游标
+    prev_cursor: str = None  # 上一页游标
+
+
+class UpsertResultSchema(BaseModel):
+    """数据插入或更新返回格式"""
+    inserted: int = 0  # 新增数量
+    updated: int = 0  # 更新数量
+
+
+class QueryAdvice(BaseModel):
+    """查询索引优化建议"""
+    table: str  # 数据表
+    column: str  # 字段
+    usage: str  # 字段用途: filter, ordering, search, link
+    indexed: bool  # 是否存在以该字段开头的索引
+    full_scan: bool = None  # 执行计划是否为全表扫描, None表示未分析
+    plan: List[str] = []  # 执行计划
+    suggestion: str = None  # 优化建议
+
+
+class QueryPlanSchema(BaseModel):
+    """查询执行计划"""
+    sql: str  # 查询语句
+    plan: List[str] = None  # 执行计划
+    full_scan: bool = None  # 是否存在全表扫描
+    count_sql: str = None  # 总数统计语句
+    count_plan: List[str] = None  # 总数统计执行计划
+
+
+class AggregateSchema(BaseModel):
+    """聚合查询返回格式,可直接作为ECharts配置"""
+    dataset: Dict[str, Any]  # 原始分组数据: dimensions, source
+    xAxis: Dict[str, Any] = None
+    yAxis: Dict[str, Any] = None
+    legend: Dict[str, Any] = None
+    tooltip: Dict[str, Any] = None
+    series: List[Dict[str, Any]] = []
+    truncated: bool = None  # 分组数量是否超出上限
+
+
+class BaseApiJSONResponse(JSONResponse):
+    """预编码JSON响应,优先使用orjson,否则使用ujson"""
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, BaseModel):
+            content = content.dict(by_alias=True)  # 与FastAPI按response_model序列化一致, 保留字段别名
+        if orjson is not None:
+            return orjson.dumps(content, default=pydantic_encoder, option=orjson.OPT_NON_STR_KEYS)
+        return ujson.dumps(content, ensure_ascii=False, default=pydantic_encoder).encode('utf-8')
 
 
 class CrudEnum(str, Enum):
@@ -35,6 +94,14 @@ class CrudEnum(str, Enum):
     read = 'read'  # 查询数据
     update = 'update'  # 更新数据
     delete = 'delete'  # 删除数据
+    export = 'export'  # 导出数据
+    upsert = 'upsert'  # 新增或更新数据
+    bulk_update = 'bulk_update'  # 批量更新不同数据
+    read_items = 'read_items'  # 按主键列表查询数据
+    update_items = 'update_items'  # 按主键列表更新数据
+    delete_items = 'delete_items'  # 按主键列表删除数据
+    list_explain = 'list_explain'  # 批量查询执行计划
+    aggregate = 'aggregate'  # 聚合查询
 
 
 class Paginator():
@@ -42,7 +109,8 @@ class Paginator():
 
     def __init__(self, page: Union[int, str] = 1, perPage: Union[int, str] = 10, show_total: int = 1,
                  orderBy: str = None,
-                 orderDir: str = 'asc'):
+                 orderDir: str = 'asc',
+                 cursor: str = None):
         self.page = page if page and page > 0 else 1
         self.perPage = perPage if perPage and perPage > 0 else 10
         if self.perPageMax:
@@ -50,3 +118,20 @@ class Paginator():
         self.show_total = show_total
         self.orderBy = orderBy
         self.orderDir = orderDir
+        self.cursor = cursor
+
+
+class Aggregator():
+    """聚合查询参数"""
+
+    def __init__(self, group_by: str = Query(None, example='category_id', description='分组字段,多个用逗号分隔'),
+                 date_field: str = Query(None, description='按日期分组的字段'),
+                 date_bucket: str = Query('day', description='日期分组粒度: day, week, month'),
+                 metrics: str = Query('count', example='count,sum:amount', description='统计指标: count, sum, avg, min, max'),
+                 chart_type: str = Query('bar', description='图表类型: bar, line, pie')):
+        self.group_by = [field for field in (group_by or '').split(',') if field]
+        self.date_field = date_field
+        self.date_bucket = date_bucket
+        self.metrics = [tuple(metric.split(':', 1)) if ':' in metric else (metric, None)
+                        for metric in metrics.split(',') if metric]
+        self.chart_type = chart_type
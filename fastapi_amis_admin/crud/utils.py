@@ -1,5 +1,8 @@
+import base64
 from enum import Enum
-from typing import Optional, Type, List, Set, Union, Iterable
+from typing import Optional, Type, List, Set, Union, Iterable, Any, Sequence, Iterator
+import ujson
+from fastapi.encoders import jsonable_encoder
 from fastapi.params import Path
 from pydantic import BaseModel, BaseConfig
 from pydantic.fields import ModelField
@@ -65,3 +68,21 @@ def parser_str_set_list(set_str: Union[int, str]) -> List[str]:
 def parser_item_id(item_id: str = Path(..., min_length=1, title='pk', example='1,2,3',
                                        description='Primary key or list of primary keys')) -> List[str]:
     return parser_str_set_list(set_str=item_id)
+
+
+def encode_cursor(values: List[Any]) -> str:
+    return base64.urlsafe_b64encode(ujson.dumps(jsonable_encoder(values)).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Optional[List[Any]]:
+    try:
+        values = ujson.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        return None
+    return values if isinstance(values, list) else None
+
+
+def chunks(lst: Sequence[Any], size: int) -> Iterator[Sequence[Any]]:
+    size = size or len(lst) or 1
+    for i in range(0, len(lst), size):
+        yield lst[i:i + size]
@@ -42,6 +42,7 @@ def Field(
         amis_form_item: Union[FormItem, dict, str] = None,
         amis_filter_item: Union[FormItem, dict, str] = None,
         amis_table_column: Union[TableColumn, dict, str] = None,
+        list_preview: int = None,
 ) -> Any:
     current_schema_extra = schema_extra or {}
     if amis_form_item:
@@ -50,6 +51,8 @@ def Field(
         current_schema_extra['amis_filter_item'] = amis_filter_item
     if amis_table_column:
         current_schema_extra['amis_table_column'] = amis_table_column
+    if list_preview is not None:  # 批量查询时截取的长度, 0表示不截取
+        current_schema_extra['list_preview'] = list_preview
     field_info = FieldInfo(
         default,
         default_factory=default_factory,
@@ -0,0 +1,144 @@
+import time
+import uuid
+import weakref
+from collections import OrderedDict, namedtuple
+from typing import Any, Hashable, Optional, Dict, Tuple
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+_NOT_FOUND = object()
+
+
+class LRUCache:
+    """进程内LRU缓存,支持过期时间及命中统计"""
+
+    def __init__(self, maxsize: int = 128, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key, _NOT_FOUND)
+        if item is not _NOT_FOUND:
+            value, expires = item
+            if expires is None or expires > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = ttl or self.ttl
+        self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+        self._data.move_to_end(key)
+        if self.maxsize and len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.hits = self.misses = 0
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._data))
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class BaseCacheBackend:
+    """缓存后端基类,可基于Redis等实现跨进程缓存"""
+    generation_ttl: float = 86400  # 数据表版本号的有效时间(秒)
+
+    async def get(self, key: str) -> Any:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    async def delete(self, *keys: str) -> None:
+        raise NotImplementedError
+
+    async def clear(self) -> None:
+        raise NotImplementedError
+
+    def info(self) -> CacheInfo:
+        raise NotImplementedError
+
+    async def get_generation(self, *tables: str) -> Tuple[Any, ...]:
+        """返回数据表版本号. 版本号通过get/set保存在缓存后端中, 共享缓存后端的进程使用相同的版本号"""
+        generations = []
+        for table in tables:
+            generation = await self.get(f'generation:{table}')
+            if generation is None:  # 版本号过期或被淘汰时使用新的版本号, 不会再命中旧的缓存
+                generation = uuid.uuid4().hex
+                await self.set(f'generation:{table}', generation, ttl=self.generation_ttl)
+            generations.append(generation)
+        return tuple(generations)
+
+    async def bump_generation(self, *tables: str) -> None:
+        """更新数据表版本号, 基于Redis等实现时可重写为原子操作"""
+        for table in tables:
+            await self.set(f'generation:{table}', uuid.uuid4().hex, ttl=self.generation_ttl)
+
+
+class MemoryCacheBackend(BaseCacheBackend):
+    """进程内LRU缓存后端"""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = 60):
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.generations: Dict[str, int] = {}  # 进程内缓存的版本号不参与淘汰及命中统计
+
+    async def get(self, key: str) -> Any:
+        return self.cache.get(key)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.cache.set(key, value, ttl)
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self.cache.delete(key)
+
+    async def clear(self) -> None:
+        self.cache.clear()
+
+    def info(self) -> CacheInfo:
+        return self.cache.info()
+
+    async def get_generation(self, *tables: str) -> Tuple[Any, ...]:
+        return tuple(self.generations.get(table, 0) for table in tables)
+
+    async def bump_generation(self, *tables: str) -> None:
+        for table in tables:
+            self.generations[table] = self.generations.get(table, 0) + 1
+
+
+class TableGeneration:
+    """数据表版本号,数据写入后更新,用于使相关的查询缓存失效.
+    版本号保存在各个缓存后端中, 多进程共享缓存后端时, 任一进程的写入都会使其他进程读取的缓存失效"""
+
+    def __init__(self):
+        self.local = MemoryCacheBackend(maxsize=0, ttl=None)  # 未设置缓存后端时使用的进程内版本号
+        self._backends: "weakref.WeakSet[BaseCacheBackend]" = weakref.WeakSet([self.local])
+
+    def register(self, backend: BaseCacheBackend) -> None:
+        """注册缓存后端, 数据写入时同时更新该后端中的版本号"""
+        self._backends.add(backend)
+
+    async def get(self, backend: Optional[BaseCacheBackend], *tables: str) -> Tuple[Any, ...]:
+        backend = backend or self.local
+        self.register(backend)
+        return await backend.get_generation(*tables)
+
+    async def bump(self, *tables: str) -> None:
+        for backend in list(self._backends):
+            await backend.bump_generation(*tables)
+
+
+table_generation = TableGeneration()
@@ -1,26 +1,417 @@
-from typing import Generator, Any, AsyncGenerator
+import asyncio
+import functools
+import itertools
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Generator, Any, AsyncGenerator, List, Optional, Dict, Callable, Union
+from pydantic import BaseModel
+from sqlalchemy import event, util, exc
+from sqlalchemy.engine import Result, Row
 from sqlalchemy.ext.asyncio import AsyncSession, AsyncEngine
 from sqlalchemy.future import Engine
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool, Pool
+from sqlalchemy.schema import DDLElement
+from sqlalchemy.sql.elements import TextClause
+from starlette.requests import Request
+from .cache import LRUCache
+
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """记录连接获取等待时间的连接池"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_count = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            wait_time = time.perf_counter() - start
+            self.wait_count += 1
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+
+
+sqlite_pragmas: Dict[str, Any] = {
+    'journal_mode': 'WAL',  # 写入时不阻塞读取
+    'synchronous': 'NORMAL',  # WAL模式下只在检查点同步磁盘
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # 负数单位为KB
+    'busy_timeout': 5000,  # 毫秒
+}
+
+
+def set_sqlite_pragmas(engine: AsyncEngine, pragmas: Dict[str, Any] = None) -> None:
+    """SQLite数据库连接建立时设置性能参数"""
+    pragmas = {**sqlite_pragmas, **(pragmas or {})}
+
+    @event.listens_for(engine.sync_engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for key, value in pragmas.items():
+            cursor.execute(f'PRAGMA {key}={value}')
+        cursor.close()
+
+
+_read_sql_pattern = re.compile(r'\s*(SELECT|EXPLAIN)\b', re.IGNORECASE)
+
+
+class SerializedWriteAsyncSession(AsyncSession):
+    """执行写入语句前获取客户端写锁, 提交或回滚后释放. 写事务串行执行, 读取仍可并发"""
+
+    _write_locked: bool = False
+
+    async def _acquire_write_lock(self) -> None:
+        if not self._write_locked:
+            await self.sync_session.info['db_client'].write_lock.acquire()
+            self._write_locked = True
+
+    def _release_write_lock(self) -> None:
+        if self._write_locked:
+            self._write_locked = False
+            self.sync_session.info['db_client'].write_lock.release()
+
+    def _has_changes(self) -> bool:
+        return bool(self.sync_session.new or self.sync_session.dirty or self.sync_session.deleted)
+
+    @staticmethod
+    def _is_write(statement) -> bool:
+        """DML及DDL语句, 以及不是以SELECT或EXPLAIN开头的文本语句视为写入语句"""
+        if getattr(statement, 'is_dml', False) or isinstance(statement, DDLElement):
+            return True
+        return isinstance(statement, TextClause) and not _read_sql_pattern.match(statement.text)
+
+    async def execute(self, statement, params=None, **kwargs):
+        if self._is_write(statement):
+            await self._acquire_write_lock()
+        return await super().execute(statement, params, **kwargs)
+
+    async def flush(self, objects=None):
+        if self._has_changes():
+            await self._acquire_write_lock()
+        return await super().flush(objects)
+
+    async def commit(self):
+        if self._has_changes():
+            await self._acquire_write_lock()
+        try:
+            return await super().commit()
+        finally:
+            self._release_write_lock()
+
+    async def rollback(self):
+        try:
+            return await super().rollback()
+        finally:
+            self._release_write_lock()
+
+    async def close(self):
+        try:
+            return await super().close()
+        finally:
+            self._release_write_lock()
+
+
+class PoolStatus(BaseModel):
+    """数据库连接池状态"""
+    url: str  # 数据库连接地址,不含密码
+    pool: str  # 连接池类型
+    size: int = None  # 连接池大小
+    checked_in: int = None  # 空闲连接数
+    checked_out: int = None  # 已借出连接数
+    overflow: int = None  # 溢出连接数
+    wait_count: int = None  # 获取连接次数
+    wait_time_avg: float = None  # 获取连接平均等待时间(秒)
+    wait_time_max: float = None  # 获取连接最长等待时间(秒)
+
+    @classmethod
+    def from_engine(cls, engine: Union[AsyncEngine, Engine]) -> "PoolStatus":
+        pool: Pool = getattr(engine, 'sync_engine', engine).pool
+        status = cls(url=engine.url.render_as_string(hide_password=True), pool=pool.__class__.__name__)
+        if isinstance(pool, QueuePool):
+            status.size, status.checked_in = pool.size(), pool.checkedin()
+            status.checked_out, status.overflow = pool.checkedout(), max(pool.overflow(), 0)
+        if isinstance(pool, TimedAsyncQueuePool):
+            status.wait_count, status.wait_time_max = pool.wait_count, pool.wait_time_max
+            status.wait_time_avg = pool.wait_time_total / pool.wait_count if pool.wait_count else 0
+        return status
 
 
 class SqlalchemyAsyncClient:
 
-    def __init__(self, engine: AsyncEngine):
+    def __init__(self, engine: AsyncEngine, replicas: List[AsyncEngine] = None,
+                 replica_strategy: str = 'round_robin', read_your_writes: float = 0,
+                 serialize_writes: bool = False):
         self.engine: AsyncEngine = engine
-        self.session_maker: sessionmaker = sessionmaker(self.engine, class_=AsyncSession, autoflush=False)
+        if serialize_writes:  # 写事务串行执行,避免SQLite写入冲突
+            self.session_maker: sessionmaker = sessionmaker(self.engine, class_=SerializedWriteAsyncSession,
+                                                            autoflush=False, info={'db_client': self})
+        else:
+            self.session_maker: sessionmaker = sessionmaker(self.engine, class_=AsyncSession, autoflush=False)
+        self._write_lock: Optional[asyncio.Lock] = None
+        self.replicas: List[AsyncEngine] = replicas or []  # 只读从库
+        self.replica_session_makers: List[sessionmaker] = [  # 从库数据可能落后于主库, 会话标记为从库
+            sessionmaker(replica, class_=AsyncSession, autoflush=False, info={'replica': True})
+            for replica in self.replicas]
+        self.replica_strategy = replica_strategy  # 从库选择策略: round_robin, least_connections
+        self.read_your_writes = read_your_writes  # 客户端写入后在该时间(秒)内从主库读取
+        self._replica_cycle = itertools.cycle(range(len(self.replicas)))
+        self._recent_writers = LRUCache(maxsize=10000, ttl=read_your_writes)
+
+    @property
+    def write_lock(self) -> asyncio.Lock:
+        """串行写入锁, 在事件循环中首次使用时创建"""
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        return self._write_lock
 
-    async def session_factory(self) -> AsyncGenerator[AsyncSession, Any]:
+    def get_client_key(self, request: Optional[Request]) -> Optional[str]:
+        """返回读写一致性窗口的客户端标识,默认为客户端IP.
+        使用反向代理或NAT时客户端IP不能区分客户端,开启read_your_writes时必须重写,例如返回用户ID或会话ID"""
+        return request.client.host if request and request.client else None
+
+    async def session_factory(self, request: Request = None) -> AsyncGenerator[AsyncSession, Any]:
         async with self.session_maker() as session:
+            client_key = self.read_your_writes and self.replicas and self.get_client_key(request)
+            if client_key:
+                event.listen(session.sync_session, 'after_commit',
+                             lambda _: self._recent_writers.set(client_key, True))
             yield session
 
+    async def warmup(self, connections: int) -> None:
+        """预先建立数据库连接, 数量不超过连接池大小"""
+        for engine in [self.engine, *self.replicas]:
+            pool = engine.sync_engine.pool
+            if not isinstance(pool, QueuePool):
+                continue
+            conns = await asyncio.gather(*[engine.connect().start() for _ in range(min(connections, pool.size()))])
+            await asyncio.gather(*[conn.close() for conn in conns])
+
+    async def dispose(self) -> None:
+        """关闭连接池中的全部连接"""
+        for engine in [self.engine, *self.replicas]:
+            await engine.dispose()
+
+    def get_pool_status(self) -> List[PoolStatus]:
+        return [PoolStatus.from_engine(engine) for engine in [self.engine, *self.replicas]]
+
+    def get_replica_session_maker(self) -> sessionmaker:
+        if self.replica_strategy == 'least_connections':
+            index = min(range(len(self.replicas)),
+                        key=lambda i: getattr(self.replicas[i].sync_engine.pool, 'checkedout', lambda: 0)())
+        else:
+            index = next(self._replica_cycle)
+        return self.replica_session_makers[index]
+
+    async def session_factory_read(self, request: Request = None) -> AsyncGenerator[AsyncSession, Any]:
+        """只读会话,存在从库时按策略选择从库,客户端最近写入过数据时使用主库"""
+        client_key = self.get_client_key(request)
+        if not self.replicas or (client_key and self._recent_writers.get(client_key)):
+            session_maker = self.session_maker
+        else:
+            session_maker = self.get_replica_session_maker()
+        async with session_maker() as session:
+            yield session
+
+
+class ThreadedStreamResult:
+    """在线程池中分批读取的流式查询结果"""
+
+    def __init__(self, result: Result, session: "ThreadedSession"):
+        self.result = result
+        self.session = session
+
+    async def partitions(self, size: int = None) -> AsyncGenerator[List[Row], None]:
+        while True:
+            rows = await self.session.run(self.result.fetchmany, size)
+            if not rows:
+                break
+            yield rows
+
+    async def close(self) -> None:
+        await self.session.run(self.result.close)
+
+
+class ThreadedSession:
+    """同步会话的异步适配器, 提供与AsyncSession相同的常用接口.
+    与AsyncSession首次执行时获取连接相同, 首次执行数据库操作时独占客户端的一个工作线程, 关闭会话后归还;
+    会话的全部数据库操作在同一工作线程中执行"""
+
+    def __init__(self, session: Session, client: "SqlalchemySyncClient"):
+        self.sync_session = session
+        self.client = client
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        if self.executor is None:
+            self.executor = await self.client.acquire_executor()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    async def run_sync(self, fn: Callable, *args, **kwargs) -> Any:
+        return await self.run(fn, self.sync_session, *args, **kwargs)
+
+    async def execute(self, statement, params=None, execution_options=util.EMPTY_DICT, **kwargs) -> Result:
+        # 在工作线程中读取全部数据, 返回的结果在事件循环中使用时不再访问数据库
+        execution_options = util.immutabledict(execution_options).union({'prebuffer_rows': True})
+        return await self.run(self.sync_session.execute, statement, params,
+                              execution_options=execution_options, **kwargs)
+
+    async def stream(self, statement, params=None, execution_options=util.EMPTY_DICT,
+                     **kwargs) -> ThreadedStreamResult:
+        execution_options = util.immutabledict(execution_options).union({'stream_results': True})
+        result = await self.run(self.sync_session.execute, statement, params,
+                                execution_options=execution_options, **kwargs)
+        return ThreadedStreamResult(result, self)
+
+    async def scalar(self, statement, params=None, **kwargs) -> Any:
+        result = await self.execute(statement, params, **kwargs)
+        return result.scalar()
+
+    async def get(self, entity, ident, **kwargs) -> Any:
+        return await self.run(self.sync_session.get, entity, ident, **kwargs)
+
+    def add(self, instance: Any) -> None:
+        self.sync_session.add(instance)
+
+    def add_all(self, instances: Any) -> None:
+        self.sync_session.add_all(instances)
+
+    async def delete(self, instance: Any) -> None:
+        await self.run(self.sync_session.delete, instance)
+
+    async def flush(self, objects=None) -> None:
+        await self.run(self.sync_session.flush, objects)
+
+    async def refresh(self, instance: Any, **kwargs) -> None:
+        await self.run(self.sync_session.refresh, instance, **kwargs)
+
+    async def commit(self) -> None:
+        await self.run(self.sync_session.commit)
+
+    async def rollback(self) -> None:
+        await self.run(self.sync_session.rollback)
+
+    async def close(self) -> None:
+        if self.executor is None:  # 未执行过数据库操作, 没有占用连接
+            self.sync_session.close()
+            return
+        try:
+            await self.run(self.sync_session.close)
+        finally:
+            self.client.release_executor(self.executor)
+            self.executor = None
+
+    def in_transaction(self) -> bool:
+        return self.sync_session.in_transaction()
+
+    async def __aenter__(self) -> "ThreadedSession":
+        return self
+
+    async def __aexit__(self, type_, value, traceback) -> None:
+        await self.close()
+
 
 class SqlalchemySyncClient:
 
-    def __init__(self, engine: Engine):
+    def __init__(self, engine: Engine, max_workers: int = None):
         self.engine: Engine = engine
         self.session_maker: sessionmaker = sessionmaker(self.engine, autoflush=False)
+        pool = self.engine.pool
+        if max_workers is None:
+            if isinstance(pool, QueuePool):  # 线程数与连接池容量一致
+                max_workers = pool.size() + max(getattr(pool, '_max_overflow', 0), 0)
+            else:
+                max_workers = min(32, (os.cpu_count() or 1) + 4)
+        # 每个工作线程使用单线程的线程池, 会话使用期间独占一个工作线程, 连接不会在线程间切换
+        self.executors: List[ThreadPoolExecutor] = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'sqlalchemy_{i}') for i in range(max_workers)]
+        self._idle_executors: Optional[asyncio.Queue] = None
+        # 等待空闲工作线程的超时时间(秒), 默认与连接池的pool_timeout一致, 超时后抛出TimeoutError而不是一直等待
+        self.executor_timeout: float = getattr(pool, '_timeout', 30)
+
+    @property
+    def idle_executors(self) -> asyncio.Queue:
+        """空闲的工作线程队列, 在事件循环中首次使用时创建"""
+        if self._idle_executors is None:
+            self._idle_executors = asyncio.Queue()
+            for executor in self.executors:
+                self._idle_executors.put_nowait(executor)
+        return self._idle_executors
+
+    async def acquire_executor(self) -> ThreadPoolExecutor:
+        """独占一个工作线程, 全部工作线程都在使用时等待, 超过executor_timeout时抛出TimeoutError"""
+        try:
+            return await asyncio.wait_for(self.idle_executors.get(), self.executor_timeout)
+        except asyncio.TimeoutError:
+            raise exc.TimeoutError(f'No idle worker thread of {len(self.executors)}, '
+                               f'timed out after {self.executor_timeout}s') from None
+
+    def release_executor(self, executor: ThreadPoolExecutor) -> None:
+        self.idle_executors.put_nowait(executor)
+
+    @asynccontextmanager
+    async def executor_scope(self) -> AsyncGenerator[ThreadPoolExecutor, None]:
+        executor = await self.acquire_executor()
+        try:
+            yield executor
+        finally:
+            self.release_executor(executor)
 
     def session_factory(self) -> Generator[Session, Any, None]:
         with self.session_maker() as session:
             yield session
+
+    async def session_factory_async(self, request: Request = None) -> AsyncGenerator[ThreadedSession, Any]:
+        """在工作线程中执行数据库操作的异步会话, 可用于SQLModelCrud及ModelAdmin"""
+        async with ThreadedSession(self.session_maker(), self) as session:
+            yield session
+
+    session_factory_read = session_factory_async
+
+    async def run_sync(self, fn: Callable, *args, **kwargs) -> Any:
+        """在工作线程中开启事务并执行 fn(connection, *args, **kwargs)"""
+
+        def run():
+            with self.engine.begin() as conn:
+                return fn(conn, *args, **kwargs)
+
+        async with self.executor_scope() as executor:
+            return await asyncio.get_running_loop().run_in_executor(executor, run)
+
+    async def warmup(self, connections: int) -> None:
+        """预先建立数据库连接, 数量不超过连接池大小"""
+        pool = self.engine.pool
+        if not isinstance(pool, QueuePool):
+            return
+        loop = asyncio.get_running_loop()
+        executors = []
+        try:
+            for _ in range(min(connections, pool.size(), len(self.executors))):
+                executors.append(await self.acquire_executor())
+            # 连接在建立连接的工作线程中关闭
+            conns = await asyncio.gather(*[loop.run_in_executor(executor, self.engine.connect)
+                                           for executor in executors])
+            await asyncio.gather(*[loop.run_in_executor(executor, conn.close)
+                                   for executor, conn in zip(executors, conns)])
+        finally:
+            for executor in executors:
+                self.release_executor(executor)
+
+    async def dispose(self) -> None:
+        """关闭连接池中的全部连接及工作线程"""
+        async with self.executor_scope() as executor:
+            await asyncio.get_running_loop().run_in_executor(executor, self.engine.dispose)
+        for executor in self.executors:
+            executor.shutdown(wait=False)
+
+    def get_pool_status(self) -> List[PoolStatus]:
+        return [PoolStatus.from_engine(self.engine)]
@@ -0,0 +1,152 @@
+import asyncio
+import tempfile
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from fastapi_amis_admin.amis.components import PageSchema
+from fastapi_amis_admin.amis_admin import admin
+from fastapi_amis_admin.amis_admin.settings import Settings
+from tests.test_crud.models import Category, Article, Tag
+
+directory = tempfile.TemporaryDirectory()
+site = admin.BaseAdminSite(Settings(database_url_async=f'sqlite+aiosqlite:///{directory.name}/admin.db'))
+
+
+@site.register_admin
+class CategoryAdmin(admin.ModelAdmin):
+    page_schema = PageSchema(label='Category')
+    model = Category
+
+
+@site.register_admin
+class TagAdmin(admin.ModelAdmin):
+    page_schema = PageSchema(label='Tag')
+    model = Tag
+
+
+@site.register_admin
+class ArticleAdmin(admin.ModelAdmin):
+    page_schema = PageSchema(label='Article')
+    model = Article
+    fields = [Article]
+    list_display = [Article.id, Article.title, Article.category_id, Category.name]
+    list_filter = [Article.title, Category.name]
+    link_model_fields = [Article.tags]
+    bulk_edit_fields = [Article.status]
+
+
+app = FastAPI()
+site.mount_app(app)
+asyncio.run(site.create_db_and_tables())
+client = TestClient(app)
+
+
+def test_fields_not_shared():
+    article_admin = site.get_model_admin('article')
+    assert ArticleAdmin.fields == [Article]  # 列表过滤的关联字段只添加到实例
+    assert 'category_name' in article_admin._list_fields_ins
+    assert ArticleAdmin(site)._list_fields_ins.keys() == article_admin._list_fields_ins.keys()
+    assert ArticleAdmin.fields == [Article]
+
+
+def get_crud(path: str) -> dict:
+    """返回模型管理页面的amis表格配置"""
+    res = client.get(f'/admin/{path}/amis.json')
+    assert res.status_code == 200, res.text
+    return res.json()['data']['body']
+
+
+def create_article(title: str) -> dict:
+    category = client.post('/admin/category/item', json={'name': f'{title}_category'}).json()['data']
+    return client.post('/admin/article/item', json={'title': title, 'category_id': category['id']}).json()['data']
+
+
+def test_fk_label_column():
+    assert site.get_model_admin('article').foreign_key_labels == {Article.category_id: 'name'}
+    column = next(column for column in get_crud('article')['columns'] if column.get('name') == 'category_id')
+    assert column['type'] == 'tpl' and column['tpl'] == '${category_id__label || category_id}', column
+    article = create_article('admin_fk_label')
+    res = client.post('/admin/article/list', json={'title': 'admin_fk_label'}).json()
+    assert res['data']['items'][0]['category_id__label'] == 'admin_fk_label_category', res
+    client.delete(f'/admin/article/item/{article["id"]}')
+
+
+def test_list_fields_url():
+    api = get_crud('article')['api']
+    assert api['url'].endswith('&fields=id,title,category_id,category__name'), api
+    article = create_article('admin_fields')
+    url = api['url'].replace('${page}', '1').replace('${perPage}', '10')
+    items = client.post(url, json={'title': 'admin_fields'}).json()['data']['items']
+    assert items == [{'id': article['id'], 'title': 'admin_fields', 'category_id': article['category_id'],
+                      'category__name': 'admin_fields_category', 'category_id__label': 'admin_fields_category'}]
+    client.delete(f'/admin/article/item/{article["id"]}')
+
+
+def test_quick_save_and_bulk_actions():
+    crud = get_crud('article')
+    assert crud['quickSaveApi']['method'] == 'put' and crud['quickSaveApi']['url'] == '/admin/article/item'
+    articles = [create_article(f'admin_bulk_{i}') for i in range(3)]
+    ids = [article['id'] for article in articles]
+    # 快速编辑提交rowsDiff, 每条数据的修改内容不同
+    res = client.put(crud['quickSaveApi']['url'], json=[{'id': ids[0], 'title': 'admin_bulk_new'},
+                                                         {'id': ids[1], 'status': 1}])
+    assert res.json()['data'] == 2, res.json()
+    update_api, delete_api = [action['dialog']['body']['api'] if 'dialog' in action else action['api']
+                              for action in crud['bulkActions']]
+    assert update_api['url'] == '/admin/article/items/update' and update_api['data']['data'] == {'status': '${status}'}
+    res = client.post(update_api['url'], json={'item_id': ids[1:], 'data': {'status': 2}})
+    assert res.json()['data'] == 2, res.json()
+    items = client.post('/admin/article/items/read', json={'item_id': ids}).json()['data']
+    assert sorted((item['title'], item['status']) for item in items) == [
+        ('admin_bulk_1', 2), ('admin_bulk_2', 2), ('admin_bulk_new', None)], items
+    assert delete_api['url'] == '/admin/article/items/delete'
+    res = client.post(delete_api['url'], json={'item_id': ids})
+    assert res.json()['data'] == 3, res.json()
+
+
+def test_link_model_form():
+    article = create_article('admin_link')
+    tags = [client.post('/admin/tag/item', json={'name': f'admin_link_{i}'}).json()['data'] for i in range(2)]
+    link_id = ','.join(str(tag['id']) for tag in tags)
+    res = client.post(f'/admin/article/tag/{article["id"]}?link_id={link_id}')
+    assert res.json()['data'] == 2, res.json()
+    url = f'/admin/tag/list?link_model=article&link_item_id={article["id"]}'
+    assert client.post(url).json()['data']['total'] == 2
+    operation = next(column for column in get_crud('article')['columns'] if column.get('type') == 'operation')
+    adaptor = operation['buttons'][0]['schemaApi']['adaptor']
+    assert '\\/admin\\/article\\/tag\\/${query.link_item_id}\\/delete' in adaptor  # 移除关联使用POST请求
+    res = client.post(f'/admin/article/tag/{article["id"]}/delete', json={'link_id': str(tags[0]['id'])})
+    assert res.json()['data'] == 1, res.json()
+    assert [item['id'] for item in client.post(url).json()['data']['items']] == [tags[1]['id']]
+    res = client.post(f'/admin/article/tag/{article["id"]}/delete', json={'link_id': [tags[1]['id']]})
+    assert res.json()['data'] == 1, res.json()
+    assert client.post(url).json()['data']['total'] == 0
+    client.delete(f'/admin/tag/item/{link_id}')
+    client.delete(f'/admin/article/item/{article["id"]}')
+
+
+def test_export_action():
+    action = next(action for action in get_crud('article')['headerToolbar']
+                  if isinstance(action, dict) and action.get('actionType') == 'download')
+    assert action['api']['responseType'] == 'blob' and action['api']['data'] == {'&': '$$'}
+    article = create_article('admin_export')
+    url = action['api']['url'].replace('${orderBy}', 'id').replace('${orderDir}', 'asc')
+    res = client.post(url, json={'title': 'admin_export'})
+    assert res.headers['content-type'].startswith('text/csv')
+    rows = res.text.splitlines()
+    assert rows[0] == 'id,title,description,status,category_id,content_id,category__name'
+    assert rows[1:] == [f'{article["id"]},admin_export,,,{article["category_id"]},,admin_export_category'], rows
+    client.delete(f'/admin/article/item/{article["id"]}')
+
+
+def test_pool_status():
+    with tempfile.TemporaryDirectory() as pool_directory:
+        settings = Settings(database_url_async=f'sqlite+aiosqlite:///{pool_directory}/pool.db',
+                            database_pool_size=2, database_pool_warmup=2)
+        pool_site = admin.BaseAdminSite(settings)
+        pool_app = FastAPI()
+        pool_site.mount_app(pool_app)
+        with TestClient(pool_app) as pool_client:  # 启动时预先建立连接
+            status = pool_client.get('/admin/db/pool_status').json()['data']
+            assert len(status) == 1 and status[0]['pool'] == 'TimedAsyncQueuePool', status
+            assert status[0]['size'] == 2 and status[0]['checked_in'] == 2 and status[0]['wait_count'] == 2
+        assert pool_site.db.get_pool_status()[0].checked_in == 0  # 关闭时释放全部连接
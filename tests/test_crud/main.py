@@ -10,7 +10,10 @@ category_crud = SQLModelCrud(Category, session_factory).register_crud()
 
 app.include_router(category_crud.router)
 
-tag_crud = SQLModelCrud(Tag, session_factory).register_crud()
+tag_crud = SQLModelCrud(Tag, session_factory)
+tag_crud.list_keyset = True
+tag_crud.list_explain = True
+tag_crud.register_crud()
 
 app.include_router(tag_crud.router)
 
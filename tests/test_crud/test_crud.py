@@ -1,10 +1,40 @@
+import asyncio
+import tempfile
+import threading
+import time
+import ujson
+from typing import Dict
 from unittest import TestCase
+from fastapi import FastAPI
 from fastapi.testclient import TestClient
-from tests.test_crud.main import app
+from pydantic import BaseModel, Json, ValidationError
+from sqlalchemy import insert, select, func, text, create_engine
+from sqlalchemy.exc import TimeoutError as SATimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import QueuePool
+from sqlmodel import SQLModel, Field
+from starlette.requests import Request
+from tests.test_crud.main import app, category_crud
+from tests.test_crud.models import Category, Article, Tag, ArticleTagLink
+from tests.test_crud.db import engine, session_factory
+from fastapi_amis_admin.crud import SQLModelCrud
+from fastapi_amis_admin.crud.base import BaseCrud
+from fastapi_amis_admin.crud.schema import BaseApiOut, ItemListSchema
+from fastapi_amis_admin.crud._sqlmodel import LinkClause
+from fastapi_amis_admin.utils.cache import MemoryCacheBackend, BaseCacheBackend
+from fastapi_amis_admin.utils.db import SqlalchemyAsyncClient, SqlalchemySyncClient, TimedAsyncQueuePool, set_sqlite_pragmas, \
+    ThreadedSession
 
 client = TestClient(app)
 
 
+def crud_client(crud: SQLModelCrud) -> TestClient:
+    """为测试专用的Crud注册路由并返回测试客户端, 不修改全局的category_crud"""
+    crud_app = FastAPI()
+    crud_app.include_router(crud.register_crud().router)
+    return TestClient(crud_app)
+
+
 class TestSQLModelCrud(TestCase):
 
     def test_register_crud(self):
@@ -30,6 +60,20 @@ class TestSQLModelCrud(TestCase):
         assert 'TagList' in schemas
         assert 'TagUpdate' in schemas
 
+    def test_register_base_crud(self):
+        class CategoryCrud(BaseCrud):  # 只实现基本路由
+            @property
+            def route_list(self):
+                return lambda: BaseApiOut(data=ItemListSchema(items=[]))
+
+            route_read = route_create = route_update = route_delete = route_list
+
+        crud = CategoryCrud(Category).register_crud()
+        paths = {route.path: route.methods for route in crud.router.routes}
+        assert paths == {'/category/list': {'POST'}, '/category/item/{item_id}': {'DELETE'},
+                         '/category/item': {'POST'}}, paths
+        assert len(crud.router.routes) == 5
+
     def test_crud_one(self):
         # create one
         res = client.post('/category/item', json={"name": 'category_name', "description": "description"})
@@ -74,3 +118,820 @@ class TestSQLModelCrud(TestCase):
         # delete one
         res = client.delete(f'/category/item/{item_ids}')
         assert res.json()['data'] == count, res.json()
+
+    def test_list_keyset(self):
+        tags = [{"name": f'tag_keyset_{i}'} for i in range(5)]
+        res = client.post('/tag/item', json=tags)
+        assert res.json()['data'] == 5, res.json()
+        # first page
+        res = client.post('/tag/list?perPage=2&orderBy=name&orderDir=desc')
+        data = res.json()['data']
+        assert [item['name'] for item in data['items']] == ['tag_keyset_4', 'tag_keyset_3'], data
+        assert data['next_cursor'] and not data['prev_cursor']
+        # next page
+        res = client.post(f'/tag/list?perPage=2&orderBy=name&orderDir=desc&cursor={data["next_cursor"]}')
+        data = res.json()['data']
+        assert [item['name'] for item in data['items']] == ['tag_keyset_2', 'tag_keyset_1'], data
+        # last page
+        res = client.post(f'/tag/list?perPage=2&orderBy=name&orderDir=desc&cursor={data["next_cursor"]}')
+        data = res.json()['data']
+        assert [item['name'] for item in data['items']] == ['tag_keyset_0'], data
+        assert not data['next_cursor']
+        # prev page
+        res = client.post(f'/tag/list?perPage=2&orderBy=name&orderDir=desc&cursor={data["prev_cursor"]}')
+        data = res.json()['data']
+        assert [item['name'] for item in data['items']] == ['tag_keyset_2', 'tag_keyset_1'], data
+        assert data['prev_cursor'] and data['next_cursor']
+        ids = ','.join(str(item['id']) for item in client.post('/tag/list?perPage=10').json()['data']['items'])
+        client.delete(f'/tag/item/{ids}')
+
+    def test_list_keyset_nullable(self):
+        class ArticleCrud(SQLModelCrud):
+            list_keyset = True
+
+        keyset_app = FastAPI()
+        keyset_app.include_router(ArticleCrud(Article, session_factory).register_crud().router)
+        keyset_client = TestClient(keyset_app)
+        statuses = [1, None, 2, None, 1]
+        articles = [{'title': f'keyset_null_{i}', 'status': status} for i, status in enumerate(statuses)]
+        assert keyset_client.post('/article/item', json=articles).json()['data'] == 5
+        for order_dir, expected in [('asc', [0, 4, 2, 1, 3]), ('desc', [3, 1, 2, 4, 0])]:
+            titles, cursor, pages = [], None, []
+            while True:  # 空值视为最大值, 逐页读取不遗漏也不重复
+                url = f'/article/list?perPage=2&orderBy=status&orderDir={order_dir}'
+                data = keyset_client.post(url + (f'&cursor={cursor}' if cursor else ''),
+                                          json={'title': '[~]keyset_null_%'}).json()['data']
+                pages.append(data)
+                titles.extend(item['title'] for item in data['items'])
+                cursor = data['next_cursor']
+                if not cursor:
+                    break
+            assert titles == [f'keyset_null_{i}' for i in expected], (order_dir, titles)
+            data = keyset_client.post(f'/article/list?perPage=2&orderBy=status&orderDir={order_dir}'
+                                      f'&cursor={pages[-1]["prev_cursor"]}',
+                                      json={'title': '[~]keyset_null_%'}).json()['data']
+            assert data['items'] == pages[1]['items'], data
+            titles = []
+            for page in [1, 2, 3]:  # 没有游标的页码使用OFFSET分页, 排序与游标分页一致
+                data = keyset_client.post(f'/article/list?perPage=2&page={page}&orderBy=status&orderDir={order_dir}',
+                                          json={'title': '[~]keyset_null_%'}).json()['data']
+                titles.extend(item['title'] for item in data['items'])
+            assert titles == [f'keyset_null_{i}' for i in expected], (order_dir, titles)
+        items = keyset_client.post('/article/list', json={'title': '[~]keyset_null_%'}).json()['data']['items']
+        keyset_client.delete('/article/item/' + ','.join(str(item['id']) for item in items))
+
+    def test_list_count_strategy(self):
+        categorys = [{"name": f'category_count_{i}'} for i in range(5)]
+        client.post('/category/item', json=categorys)
+        for strategy in ['exact', 'window', 'estimated']:
+            count_crud = SQLModelCrud(Category, session_factory)
+            count_crud.count_strategy = strategy
+            res = crud_client(count_crud).post('/category/list?perPage=2&page=2', json={'name': '[~]category_count_%'})
+            data = res.json()['data']
+            assert data['total'] == 5, (strategy, data)
+            assert len(data['items']) == 2, (strategy, data)
+            assert '_total' not in data['items'][0]
+        count_crud = SQLModelCrud(Category, session_factory)
+        count_crud.count_strategy = 'capped'
+        count_crud.count_capped_max = 3
+        data = crud_client(count_crud).post('/category/list?perPage=2', json={'name': '[~]category_count_%'}).json()[
+            'data']
+        assert data['total'] == 3 and data['total_capped'], data
+        res = client.post('/category/list?perPage=10', json={'name': '[~]category_count_%'})
+        client.delete('/category/item/' + ','.join(str(item['id']) for item in res.json()['data']['items']))
+
+    def test_export(self):
+        categorys = [{"name": f'category_export_{i}', "description": "description"} for i in range(3)]
+        client.post('/category/item', json=categorys)
+        res = client.post('/category/export?format=csv&orderBy=name&orderDir=desc')
+        assert res.headers['content-type'].startswith('text/csv'), res.text
+        lines = res.text.splitlines()
+        assert lines[0] == 'id,name,description', lines
+        assert len(lines) == 4 and lines[1].split(',')[1] == 'category_export_2', lines
+        res = client.post('/category/export?format=ndjson', json={"name": "[~]export_1"})
+        lines = res.text.splitlines()
+        assert len(lines) == 1 and ujson.loads(lines[0])['name'] == 'category_export_1', lines
+        # 导出会话在响应体生成器中创建, 数据发送完成后关闭
+        events = []
+
+        async def tracked_session_factory():
+            async for session in session_factory():
+                events.append('open')
+                try:
+                    yield session
+                finally:
+                    events.append('close')
+
+        export_app = FastAPI()
+        export_app.include_router(SQLModelCrud(Category, tracked_session_factory).register_crud().router)
+        res = TestClient(export_app).post('/category/export?format=ndjson', json={"name": "[~]category_export_"})
+        assert len(res.text.splitlines()) == 3 and events == ['open', 'close'], events
+        ids = ','.join(str(item['id']) for item in client.post('/category/list?perPage=10').json()['data']['items'])
+        client.delete(f'/category/item/{ids}')
+
+    def test_row_mapper(self):
+        res = client.post('/category/item', json={"name": 'category_mapper', "description": "description"})
+        category = res.json()['data']
+        rows = client.post('/category/list', json={"name": "category_mapper"}).json()['data']['items']
+        assert rows == [category], rows
+        assert len(category_crud._row_mappers) > 0
+        res = client.get(f'/category/item/{category["id"]}')
+        assert res.json()['data'] == category, res.json()
+        client.delete(f'/category/item/{category["id"]}')
+        res = client.get(f'/category/item/{category["id"]}')
+        assert res.json()['data'] is None, res.json()
+
+    def test_row_mapper_json(self):
+        class CategoryJson(BaseModel):
+            id: int
+            name: str
+            description: Json[Dict[str, int]]
+
+        client.post('/category/item', json=[{"name": 'mapper_json_a', "description": '{"a": 1}'},
+                                            {"name": 'mapper_json_b', "description": 'invalid'}])
+
+        async def fetch(name: str):
+            async for session in session_factory():
+                result = await session.execute(select(Category.id, Category.name, Category.description)
+                                               .where(Category.name == name))
+                return category_crud._conv_rows(result.all(), CategoryJson)
+
+        assert asyncio.run(fetch('mapper_json_a'))[0].description == {'a': 1}  # 文本列中的Json字段被解析
+        with self.assertRaises(ValidationError):
+            asyncio.run(fetch('mapper_json_b'))
+        ids = ','.join(str(item['id']) for item in
+                       client.post('/category/list', json={"name": "[~]mapper_json_%"}).json()['data']['items'])
+        client.delete(f'/category/item/{ids}')
+
+    def test_response_raw(self):
+        categorys = [{"name": f'category_raw_{i}', "description": "description"} for i in range(2)]
+        client.post('/category/item', json=categorys)
+        data = client.post('/category/list?orderBy=name').json()
+        openapi = crud_client(SQLModelCrud(Category, session_factory)).get('/openapi.json').json()
+        raw_crud = SQLModelCrud(Category, session_factory)
+        raw_crud.response_raw = True
+        raw_client = crud_client(raw_crud)
+        assert raw_client.post('/category/list?orderBy=name').json() == data
+        assert raw_client.get('/openapi.json').json() == openapi
+        item = data['data']['items'][0]
+        assert raw_client.get(f'/category/item/{item["id"]}').json()['data'] == item
+        # 关联模型字段保留别名, 例如: category__name
+        article_client = crud_client(SQLModelCrud(Article, session_factory, fields=[Article, Category.name]))
+        raw_article_crud = SQLModelCrud(Article, session_factory, fields=[Article, Category.name])
+        raw_article_crud.response_raw = True
+        raw_article_client = crud_client(raw_article_crud)
+        article = article_client.post('/article/item', json={'title': 'raw_join', 'category_id': item['id']}).json()
+        res = article_client.post('/article/list', json={'title': 'raw_join'}).json()
+        assert res['data']['items'][0]['category__name'] == item['name'], res
+        assert raw_article_client.post('/article/list', json={'title': 'raw_join'}).json() == res
+        article_client.delete(f'/article/item/{article["data"]["id"]}')
+        ids = ','.join(str(item['id']) for item in data['data']['items'])
+        client.delete(f'/category/item/{ids}')
+
+    def test_filter_cache(self):
+        categorys = [{'id': 100 + i, "name": f'category_filter_{i}', "description": "description"} for i in range(4)]
+        client.post('/category/item', json=categorys)
+        category_crud._filter_cache.clear()
+        res = client.post('/category/list', json={"id": "[*]100,101,102", "name": "[~]filter_1"})
+        assert [item['id'] for item in res.json()['data']['items']] == [101], res.json()
+        res = client.post('/category/list', json={"id": "[*]102,103", "name": "[~]filter"})
+        assert [item['id'] for item in res.json()['data']['items']] == [102, 103], res.json()
+        res = client.post('/category/list', json={"id": "[-]101,102"})
+        assert res.json()['data']['total'] == 2, res.json()
+        info = category_crud.filter_cache_info()
+        assert info.hits == 1 and info.misses == 2, info
+        clause = category_crud.calc_filter_clause({"id": "[>]102"})[0]
+        assert clause.compile(compile_kwargs={"literal_binds": True}).string == 'category.id > 102'
+
+        class CategoryCrud(SQLModelCrud):
+            def calc_filter_clause(self, data):  # 重写过滤条件时, 路由使用该方法的结果
+                return [*super().calc_filter_clause(data), Category.id != 101]
+
+        override_client = crud_client(CategoryCrud(Category, session_factory))
+        res = override_client.post('/category/list', json={"name": "[~]category_filter_"})
+        assert [item['id'] for item in res.json()['data']['items']] == [100, 102, 103], res.json()
+        res = override_client.post('/category/export?format=ndjson', json={"name": "[~]category_filter_"})
+        assert len(res.text.splitlines()) == 3, res.text
+        client.delete('/category/item/100,101,102,103')
+
+    def test_create_bulk_chunked(self):
+        count = 25
+        categorys = [{"name": f'category_chunk_{i}', "description": "description"} for i in range(count)]
+        chunk_crud = SQLModelCrud(Category, session_factory)
+        chunk_crud.bulk_chunk_size = 10
+        res = crud_client(chunk_crud).post('/category/item', json=categorys)
+        assert res.json()['data'] == count, res.json()
+        ids = res.json().get('ids')
+        res = client.post('/category/list?perPage=100', json={"name": "[~]category_chunk_", "orderBy": "id"})
+        items = res.json()['data']['items']
+        assert len(items) == count, res.json()
+        dialect = engine.sync_engine.dialect
+        if getattr(dialect, 'insert_returning', getattr(dialect, 'full_returning', False)):
+            assert ids == [item['id'] for item in items], ids
+        else:
+            assert ids is None, ids
+        client.delete('/category/item/' + ','.join(str(item['id']) for item in items))
+
+    def test_upsert(self):
+        res = client.post('/category/item', json={'id': 200, "name": 'category_upsert_0', "description": "old"})
+        assert res.json()['data']['id'] == 200, res.json()
+        categorys = [{'id': 200 + i, "name": f'category_upsert_{i}', "description": "new"} for i in range(3)]
+        res = client.post('/category/upsert', json=categorys)
+        assert res.json()['data'] == {'inserted': 2, 'updated': 1}, res.json()
+        res = client.get('/category/item/200,201,202')
+        assert [item['description'] for item in res.json()['data']] == ['new'] * 3, res.json()
+        # 重复的冲突字段值只保留最后一条
+        categorys = [{'id': 202, "name": 'category_upsert_2', "description": "dup_0"},
+                     {'id': 203, "name": 'category_upsert_3', "description": "dup_1"},
+                     {'id': 203, "name": 'category_upsert_3', "description": "dup_2"}]
+        res = client.post('/category/upsert', json=categorys)
+        assert res.json()['data'] == {'inserted': 1, 'updated': 1}, res.json()
+        res = client.get('/category/item/202,203')
+        assert [item['description'] for item in res.json()['data']] == ['dup_0', 'dup_2'], res.json()
+        # 非冲突字段的唯一约束冲突
+        res = client.post('/category/upsert', json=[{'id': 204, "name": 'category_upsert_0', "description": "new"}])
+        assert res.status_code == 422 and res.json()['detail'] == 'Key already exists', res.json()
+        client.delete('/category/item/200,201,202,203')
+
+    def test_bulk_update(self):
+        categorys = [{'id': 300 + i, "name": f'category_bulk_update_{i}', "description": "old"} for i in range(3)]
+        client.post('/category/item', json=categorys)
+        res = client.put('/category/item', json=[{'id': 300, 'description': 'new_0'},
+                                                 {'id': 301, 'name': 'category_bulk_update_new_1'},
+                                                 {'id': 302, 'description': 'new_2'}])
+        assert res.json()['data'] == 3, res.json()
+        items = client.get('/category/item/300,301,302').json()['data']
+        items = {item['id']: item for item in items}
+        assert items[300]['description'] == 'new_0' and items[302]['description'] == 'new_2', items
+        assert items[301]['name'] == 'category_bulk_update_new_1' and items[301]['description'] == 'old', items
+
+        class CategoryCrud(SQLModelCrud):
+            async def has_update_permission(self, request, item_id, obj, **kwargs):  # 按单条数据检查权限
+                assert obj is None or isinstance(obj, BaseModel)
+                return item_id != ['302']
+
+        permission_client = crud_client(CategoryCrud(Category, session_factory))
+        res = permission_client.put('/category/item', json=[{'id': 300, 'description': 'denied'}])
+        assert res.json()['data'] == 1, res.json()
+        res = permission_client.put('/category/item', json=[{'id': 301, 'description': 'denied'},
+                                                            {'id': 302, 'description': 'denied'}])
+        assert res.status_code == 401, res.json()
+        assert client.get('/category/item/301').json()['data']['description'] == 'old'
+        client.delete('/category/item/300,301,302')
+
+    def test_items_chunked(self):
+        count = 30
+        categorys = [{'id': 400 + i, "name": f'category_items_{i}', "description": "old"} for i in range(count)]
+        client.post('/category/item', json=categorys)
+        item_id = [400 + i for i in range(count)]
+        chunk_crud = SQLModelCrud(Category, session_factory)
+        chunk_crud.bulk_chunk_size = 7
+        chunk_client = crud_client(chunk_crud)
+        res = chunk_client.post('/category/items/read', json={'item_id': item_id})
+        assert len(res.json()['data']) == count, res.json()
+        res = chunk_client.post('/category/items/update', json={'item_id': item_id, 'data': {'description': 'new'}})
+        assert res.json()['data'] == count, res.json()
+        res = chunk_client.post('/category/items/read', json={'item_id': item_id[:1]})
+        assert res.json()['data'][0]['description'] == 'new', res.json()
+        res = chunk_client.post('/category/items/delete', json={'item_id': item_id})
+        assert res.json()['data'] == count, res.json()
+
+    def test_read_cache(self):
+        cache_crud = SQLModelCrud(Category, session_factory)
+        cache_crud.read_cache = MemoryCacheBackend(maxsize=10, ttl=60)
+        cache_client = crud_client(cache_crud)
+        res = cache_client.post('/category/item', json={'id': 500, "name": 'category_cache', "description": "old"})
+        assert res.json()['data']['id'] == 500, res.json()
+        assert cache_client.get('/category/item/500').json()['data']['description'] == 'old'
+        assert cache_client.get('/category/item/500').json()['data']['description'] == 'old'
+        assert cache_crud.read_cache.info().hits == 1
+        cache_client.put('/category/item/500', json={"description": "new"})
+        assert cache_client.get('/category/item/500').json()['data']['description'] == 'new'
+        cache_client.put('/category/item', json=[{'id': 500, "description": "new2"}])
+        assert cache_client.get('/category/item/500').json()['data']['description'] == 'new2'
+        cache_client.delete('/category/item/500')
+        assert cache_client.get('/category/item/500').json()['data'] is None
+
+    def test_read_cache_join(self):
+        class ArticleCrud(SQLModelCrud):
+            read_cache = MemoryCacheBackend(maxsize=10, ttl=60)
+
+        article_crud = ArticleCrud(Article, session_factory, fields=[Article, Category.name])
+        article_crud.register_crud(schema_read=article_crud.schema_list)  # 读取数据包含关联模型字段
+        read_app = FastAPI()
+        read_app.include_router(article_crud.router)
+        read_client = TestClient(read_app)
+        category = client.post('/category/item', json={'name': 'read_join_old'}).json()['data']
+        article = read_client.post('/article/item', json={'title': 'read_join', 'category_id': category['id']}).json()
+        url = f'/article/item/{article["data"]["id"]}'
+        assert read_client.get(url).json()['data']['category__name'] == 'read_join_old'
+        assert read_client.get(url).json()['data']['category__name'] == 'read_join_old'
+        assert article_crud.read_cache.info().hits == 1
+        client.put(f'/category/item/{category["id"]}', json={'name': 'read_join_new'})  # 关联表写入后缓存失效
+        assert read_client.get(url).json()['data']['category__name'] == 'read_join_new'
+        read_client.delete(url)
+        client.delete(f'/category/item/{category["id"]}')
+
+    def test_list_cache(self):
+        class CategoryCrud(SQLModelCrud):
+            list_cache = MemoryCacheBackend(maxsize=10, ttl=None)
+
+        cache_crud = CategoryCrud(Category, session_factory).register_crud()
+        cache_app = FastAPI()
+        cache_app.include_router(cache_crud.router)
+        with TestClient(cache_app) as cache_client:  # 后台刷新任务需要在同一事件循环中完成
+            total = cache_client.post('/category/list').json()['data']['total']
+            assert cache_client.post('/category/list').json()['data']['total'] == total
+            assert cache_crud.list_cache.info().hits == 1
+            # 其他Crud写入同一数据表后缓存失效
+            client.post('/category/item', json={'id': 501, "name": 'category_list_cache'})
+            assert cache_client.post('/category/list').json()['data']['total'] == total + 1
+            res = cache_client.post('/category/list', json={'name': 'category_list_cache'})
+            assert res.json()['data']['items'][0]['id'] == 501
+            client.delete('/category/item/501')
+            res = cache_client.post('/category/list', json={'name': 'category_list_cache'})
+            assert res.json()['data']['total'] == 0
+            cache_crud.list_cache_ttl = 0  # 过期数据仍然返回并在后台刷新
+            hits = cache_crud.list_cache.info().hits
+            cache_client.post('/category/list')
+            assert cache_client.post('/category/list').json()['data']['total'] == total
+            assert cache_crud.list_cache.info().hits == hits + 1
+            while cache_crud._cache_tasks:
+                time.sleep(0.01)
+
+    def test_list_cache_shared(self):
+        class SharedCacheBackend(BaseCacheBackend):  # 模拟多个进程共享的缓存后端
+            def __init__(self):
+                self.data = {}
+
+            async def get(self, key):
+                return self.data.get(key)
+
+            async def set(self, key, value, ttl=None):
+                self.data[key] = value
+
+        class CategoryCrud(SQLModelCrud):
+            list_cache = SharedCacheBackend()
+
+        cache_crud = CategoryCrud(Category, session_factory).register_crud()
+        cache_app = FastAPI()
+        cache_app.include_router(cache_crud.router)
+        cache_client = TestClient(cache_app)
+        total = cache_client.post('/category/list').json()['data']['total']
+        assert 'generation:category' in cache_crud.list_cache.data  # 版本号保存在缓存后端中
+
+        async def other_process_write():  # 其他进程写入数据, 并更新共享缓存后端中的版本号
+            async for session in session_factory():
+                await session.execute(insert(Category.__table__).values(id=505, name='category_list_shared'))
+                await session.commit()
+            await cache_crud.list_cache.bump_generation('category')
+
+        asyncio.run(other_process_write())
+        assert cache_client.post('/category/list').json()['data']['total'] == total + 1
+        client.delete('/category/item/505')
+        assert cache_client.post('/category/list').json()['data']['total'] == total
+
+    def test_search_fulltext(self):
+        class CategoryCrud(SQLModelCrud):
+            search_fields = [Category.name]
+            search_fulltext = True
+
+        search_crud = CategoryCrud(Category, session_factory)
+        search_client = crud_client(search_crud)
+        search_client.post('/category/item', json=[{'id': 502, "name": 'fulltext alpha'},
+                                                   {'id': 503, "name": 'fulltext beta'}])
+        asyncio.run(search_crud.create_search_index())
+        assert search_crud._search_engine == 'fts5'
+        res = search_client.post('/category/list', json={'name': '[~]fullte alp'})
+        assert [item['id'] for item in res.json()['data']['items']] == [502]
+        search_client.put('/category/item/503', json={"name": 'fulltext alpha2'})
+        res = search_client.post('/category/list', json={'name': '[~]alpha'})
+        assert [item['id'] for item in res.json()['data']['items']] == [502, 503]
+        search_client.delete('/category/item/502')
+        res = search_client.post('/category/list', json={'name': '[~]alpha'})
+        assert [item['id'] for item in res.json()['data']['items']] == [503]
+        search_client.delete('/category/item/502,503')
+
+    def test_search_fulltext_pk(self):
+        class SearchNote(SQLModel, table=True):
+            id: str = Field(primary_key=True)
+            body: str = ''
+
+        class SearchNoteCrud(SQLModelCrud):
+            search_fields = [SearchNote.body]
+            search_fulltext = True
+
+        note_crud = SearchNoteCrud(SearchNote, session_factory)
+        with self.assertLogs('fastapi_amis_admin.crud._sqlmodel', 'WARNING'):  # 主键不是整数时不创建全文索引
+            asyncio.run(note_crud.create_search_index())
+        assert note_crud._search_engine is None
+
+    def test_query_advisor(self):
+        client.post('/category/item', json={'id': 504, "name": 'category_advisor', "description": "advisor"})
+        client.post('/tag/item', json={'id': 504, "name": 'tag_advisor'})
+        try:
+            advices = {advice.column: advice for advice in asyncio.run(category_crud.get_query_advices())}
+            assert 'name' not in advices and 'id' not in advices
+            assert advices['description'].indexed is False
+            assert advices['description'].full_scan is True
+            assert advices['description'].suggestion.startswith('CREATE INDEX ix_category_description')
+            res = client.post('/tag/list/explain?orderBy=name&orderDir=desc', json={'name': 'tag_advisor'})
+            data = res.json()['data']
+            assert "'tag_advisor'" in data['sql'] and data['plan'] and data['full_scan'] is False
+            assert data['count_plan']
+            assert '/category/list/explain' not in client.get('/openapi.json').json()['paths']
+        finally:
+            client.delete('/category/item/504')
+            client.delete('/tag/item/504')
+
+    def test_replica_routing(self):
+        replicas = [create_async_engine('sqlite+aiosqlite:///test_crud.db', future=True) for _ in range(2)]
+        db = SqlalchemyAsyncClient(engine, replicas=replicas, read_your_writes=60)
+        writer = Request({'type': 'http', 'client': ('10.0.0.1', 0)})
+        reader = Request({'type': 'http', 'client': ('10.0.0.2', 0)})
+
+        async def run():
+            binds = []
+            for _ in range(3):
+                async for session in db.session_factory_read(writer):
+                    binds.append(session.bind)
+            assert binds == [replicas[0], replicas[1], replicas[0]]
+            async for session in db.session_factory(writer):
+                await session.commit()
+            async for session in db.session_factory_read(writer):
+                assert session.bind is engine  # 写入后从主库读取
+            async for session in db.session_factory_read(reader):
+                assert session.bind in replicas and session.info['replica']
+
+        asyncio.run(run())
+        # 从库读取的数据不直接写入缓存, 写入后的一致性窗口内从主库读取并缓存
+
+        class CategoryCrud(SQLModelCrud):
+            session_factory_read = db.session_factory_read
+            read_cache = MemoryCacheBackend()
+            list_cache = MemoryCacheBackend()
+
+        replica_crud = CategoryCrud(Category, db.session_factory).register_crud()
+        replica_app = FastAPI()
+        replica_app.include_router(replica_crud.router)
+        client.post('/category/item', json={'id': 506, 'name': 'category_replica', 'description': 'old'})
+        with TestClient(replica_app) as replica_client:  # 后台刷新任务需要在同一事件循环中完成
+            assert replica_client.get('/category/item/506').json()['data']['description'] == 'old'
+            while replica_crud._cache_tasks:  # 从库未命中缓存时, 在后台从主库读取并写入缓存
+                time.sleep(0.01)
+            assert replica_crud.read_cache.info().currsize == 1
+            assert replica_client.get('/category/item/506').json()['data']['description'] == 'old'
+            assert replica_crud.read_cache.info().hits == 1
+            for _ in range(2):
+                res = replica_client.post('/category/list', json={'id': 506}).json()
+                assert res['data']['items'][0]['description'] == 'old', res
+                while replica_crud._cache_tasks:
+                    time.sleep(0.01)
+            assert replica_crud.list_cache.info().hits == 1  # 批量查询缓存同样由主库填充
+            assert replica_client.put('/category/item/506', json={'description': 'new'}).json()['data'] == 1
+            assert replica_client.get('/category/item/506').json()['data']['description'] == 'new'
+            assert replica_crud.read_cache.info().currsize == 1
+        client.delete('/category/item/506')
+
+    def test_pool_warmup_status(self):
+        pool_engine = create_async_engine('sqlite+aiosqlite:///test_crud.db', future=True,
+                                          poolclass=TimedAsyncQueuePool, pool_size=3)
+        db = SqlalchemyAsyncClient(pool_engine)
+
+        async def run():
+            await db.warmup(5)
+            status = db.get_pool_status()[0]
+            assert status.pool == 'TimedAsyncQueuePool'
+            assert status.size == 3 and status.checked_in == 3 and status.checked_out == 0
+            assert status.wait_count == 3 and status.wait_time_max >= status.wait_time_avg > 0
+            await pool_engine.dispose()
+
+        asyncio.run(run())
+
+    def test_sqlite_profile(self):
+        with tempfile.TemporaryDirectory() as directory:
+            sqlite_engine = create_async_engine(f'sqlite+aiosqlite:///{directory}/profile.db', future=True)
+            set_sqlite_pragmas(sqlite_engine)
+            db = SqlalchemyAsyncClient(sqlite_engine, serialize_writes=True)
+            events = []
+
+            async def write(name: str, delay: float):
+                await asyncio.sleep(delay)
+                async for session in db.session_factory():
+                    await session.execute(text('SELECT 1'))
+                    assert not session._write_locked  # 读取语句不获取写锁
+                    if name == 'a':
+                        await session.execute(insert(Category.__table__).values(name=name))
+                    else:  # 文本写入语句同样串行执行
+                        await session.execute(text('INSERT INTO category (name, description) VALUES (:name, \'\')'),
+                                              {'name': name})
+                    events.append(f'{name} insert')
+                    assert db.write_lock.locked()
+                    await asyncio.sleep(0.05)
+                    await session.commit()
+                    events.append(f'{name} commit')
+
+            async def run():
+                async with sqlite_engine.begin() as conn:
+                    await conn.run_sync(Category.__table__.create)
+                    assert (await conn.execute(text('PRAGMA journal_mode'))).scalar() == 'wal'
+                    assert (await conn.execute(text('PRAGMA synchronous'))).scalar() == 1
+                await asyncio.gather(write('a', 0), write('b', 0.01))
+                assert not db.write_lock.locked()
+                async for session in db.session_factory():
+                    assert (await session.execute(select(func.count()).select_from(Category))).scalar() == 2
+                await sqlite_engine.dispose()
+
+            asyncio.run(run())
+            assert events == ['a insert', 'a commit', 'b insert', 'b commit']
+
+    def test_release_session(self):
+        sessions = []
+
+        async def tracked_session_factory():
+            async for session in session_factory():
+                yield session
+                sessions.append(session.in_transaction())
+
+        crud = SQLModelCrud(Category, tracked_session_factory)
+        crud.register_crud()
+        tracked_app = FastAPI()
+        tracked_app.include_router(crud.router)
+        tracked_client = TestClient(tracked_app)
+        assert tracked_client.post('/category/list').json()['status'] == 0
+        assert tracked_client.get('/category/item/1').json()['status'] == 0
+        assert tracked_client.post('/category/items/read', json={'item_id': [1, 2]}).json()['status'] == 0
+        assert sessions == [False, False, False]  # 响应前已归还连接
+
+    def test_sync_engine(self):
+        with tempfile.TemporaryDirectory() as directory:
+            pool_engine = create_engine(f'sqlite:///{directory}/pool.db', future=True,
+                                        poolclass=QueuePool, pool_size=2, max_overflow=1)
+            assert len(SqlalchemySyncClient(pool_engine).executors) == 3  # 线程数与连接池容量一致
+            # 会话的全部操作在同一工作线程中执行, SQLite无需关闭check_same_thread
+            sync_engine = create_engine(f'sqlite:///{directory}/sync.db', future=True)
+            db = SqlalchemySyncClient(sync_engine, max_workers=2)
+            asyncio.run(db.run_sync(Category.__table__.create))
+
+            async def pinned():
+                threads = set()
+                async for session in db.session_factory_async():
+                    for _ in range(5):
+                        threads.add(await session.run(threading.get_ident))
+                    await session.execute(select(Category))
+                return threads
+
+            assert len(asyncio.run(pinned())) == 1
+
+            async def exhausted():  # 首次执行时才占用工作线程, 全部占用时等待超时而不是一直阻塞
+                sessions = [ThreadedSession(db.session_maker(), db) for _ in range(3)]
+                assert db.idle_executors.qsize() == 2
+                await sessions[0].execute(select(Category))
+                await sessions[1].execute(select(Category))
+                db.executor_timeout = 0.1
+                try:
+                    with self.assertRaises(SATimeoutError):
+                        await sessions[2].execute(select(Category))
+                finally:
+                    db.executor_timeout = 30
+                for session in sessions:
+                    await session.close()
+                assert db.idle_executors.qsize() == 2
+
+            asyncio.run(exhausted())
+            crud = SQLModelCrud(Category, db.session_factory_async)
+            crud.register_crud()
+            sync_app = FastAPI()
+            sync_app.include_router(crud.router)
+            sync_client = TestClient(sync_app)
+            res = sync_client.post('/category/item', json=[{'name': 'sync_a'}, {'name': 'sync_b'}]).json()
+            assert res['data'] == 2
+            res = sync_client.post('/category/list', json={'name': '[~]sync_%'}).json()
+            assert [item['name'] for item in res['data']['items']] == ['sync_a', 'sync_b']
+            assert sync_client.get('/category/item/1').json()['data']['name'] == 'sync_a'
+            assert sync_client.put('/category/item/1', json={'name': 'sync_c'}).json()['data'] == 1
+            assert sync_client.delete('/category/item/2').json()['data'] == 1
+            res = sync_client.post('/category/list').json()
+            assert [item['name'] for item in res['data']['items']] == ['sync_c']
+            assert db.idle_executors.qsize() == 2  # 会话关闭后归还工作线程
+            asyncio.run(db.dispose())
+            # 导出路由只在响应体中使用一个会话, 单个工作线程时不会阻塞
+            link_table = ArticleTagLink.__table__
+            export_engine = create_engine(f'sqlite:///{directory}/export.db', future=True)
+            export_db = SqlalchemySyncClient(export_engine, max_workers=1)
+            asyncio.run(export_db.run_sync(SQLModel.metadata.create_all, tables=[Tag.__table__, link_table]))
+
+            class TagCrud(SQLModelCrud):
+                link_models = {'article': (link_table, link_table.c.tag_id, link_table.c.article_id)}
+
+            export_client = crud_client(TagCrud(Tag, export_db.session_factory_async))
+            res = export_client.post('/tag/item', json=[{'name': 'export_a'}, {'name': 'export_b'}])
+            assert res.json()['data'] == 2
+            link = {'tag_id': 2, 'article_id': 1}
+            asyncio.run(export_db.run_sync(lambda conn: conn.execute(insert(link_table), link)))
+            res = export_client.post('/tag/export?format=ndjson')
+            assert [ujson.loads(line)['name'] for line in res.text.splitlines()] == ['export_a', 'export_b']
+            res = export_client.post('/tag/export?format=ndjson&link_model=article&link_item_id=1')
+            assert [ujson.loads(line)['name'] for line in res.text.splitlines()] == ['export_b']
+            assert export_client.post('/tag/list').json()['data']['total'] == 2
+            asyncio.run(export_db.dispose())
+
+    def test_list_join(self):
+        article_crud = SQLModelCrud(Article, session_factory, fields=[Article, Category.name])
+        assert [(table.name, isouter) for table, _, isouter in article_crud._list_joins] == [('category', True)]
+        with self.assertLogs('fastapi_amis_admin.crud._sqlmodel', 'WARNING'):  # 无法确定连接条件
+            assert SQLModelCrud(Category, session_factory, fields=[Category, Tag.name])._list_joins == []
+        article_crud.register_crud()
+        join_app = FastAPI()
+        join_app.include_router(article_crud.router)
+        join_client = TestClient(join_app)
+        category = client.post('/category/item', json={'name': 'join_category'}).json()['data']
+        res = join_client.post('/article/item', json=[{'title': 'join_b'},  # 排序结果与插入顺序无关
+                                                       {'title': 'join_a', 'category_id': category['id']}]).json()
+        assert res['data'] == 2
+        res = join_client.post('/article/list?orderBy=category_name&orderDir=desc',
+                               json={'title': '[~]join_%'}).json()
+        assert res['data']['total'] == 2  # 左外连接保留无分类的文章
+        assert [(item['title'], item['category__name']) for item in res['data']['items']] == [
+            ('join_a', 'join_category'), ('join_b', None)]
+        res = join_client.post('/article/list', json={'category__name': 'join_category'}).json()
+        assert res['data']['total'] == 1
+        assert res['data']['items'][0]['title'] == 'join_a'
+        res = join_client.post('/article/list', json={'title': '[~]join_%'}).json()
+        join_client.delete('/article/item/' + ','.join(str(item['id']) for item in res['data']['items']))
+        client.delete(f'/category/item/{category["id"]}')
+
+    def test_foreign_key_labels(self):
+        class ArticleCrud(SQLModelCrud):
+            foreign_key_labels = {Article.category_id: Category.name}
+
+        article_crud = ArticleCrud(Article, session_factory).register_crud()
+        label_app = FastAPI()
+        label_app.include_router(article_crud.router)
+        label_client = TestClient(label_app)
+        category_ids = [client.post('/category/item', json={'name': f'label_{i}'}).json()['data']['id'] for i in range(2)]
+        res = label_client.post('/article/item', json=[{'title': 'label_a', 'category_id': category_ids[0]},
+                                                        {'title': 'label_b', 'category_id': category_ids[1]},
+                                                        {'title': 'label_c', 'category_id': category_ids[0]},
+                                                        {'title': 'label_d'}]).json()
+        assert res['data'] == 4
+        res = label_client.post('/article/list', json={'title': '[~]label_%'}).json()
+        assert [item['category_id__label'] for item in res['data']['items']] == ['label_0', 'label_1', 'label_0', None]
+        assert article_crud._fk_label_cache.info().currsize == 2  # 一次IN查询, 已缓存
+        label_client.post('/article/list', json={'title': '[~]label_%'})
+        assert article_crud._fk_label_cache.info().hits == 2
+        ids = ','.join(str(item['id']) for item in res['data']['items'])
+        label_client.delete(f'/article/item/{ids}')
+        client.delete(f'/category/item/{",".join(map(str, category_ids))}')
+
+    def test_aggregate(self):
+        class ArticleCrud(SQLModelCrud):
+            list_cache = MemoryCacheBackend()
+
+        aggregate_client = crud_client(ArticleCrud(Article, session_factory))
+        categories = client.post('/category/item', json=[{'name': 'aggregate_1'}, {'name': 'aggregate_2'}])
+        assert categories.json()['data'] == 2
+        c1, c2 = [item['id'] for item in client.post('/category/list', json={'name': '[~]aggregate_%'}).json()[
+            'data']['items']]
+        articles = [{'title': '2022-01-05', 'status': 1, 'category_id': c1, 'description': 'aggregate'},
+                    {'title': '2022-01-20', 'status': 2, 'category_id': c2, 'description': 'aggregate'},
+                    {'title': '2022-02-03', 'status': 3, 'category_id': c1, 'description': 'aggregate'}]
+        assert aggregate_client.post('/article/item', json=articles).json()['data'] == 3
+        scope = {'description': 'aggregate'}  # 只统计当前测试的数据
+        res = aggregate_client.post('/article/aggregate?group_by=category_id&metrics=count,sum:status',
+                                    json=scope).json()
+        assert res['data']['dataset'] == {'dimensions': ['category_id', 'count', 'sum_status'],
+                                          'source': [[c1, 2, 4], [c2, 1, 2]]}
+        assert res['data']['xAxis']['data'] == [c1, c2]
+        assert [(item['name'], item['data']) for item in res['data']['series']] == [('count', [2, 1]),
+                                                                                     ('sum_status', [4, 2])]
+        # 按月分组, 并按分类拆分系列
+        res = aggregate_client.post('/article/aggregate?date_field=title&date_bucket=month&group_by=category_id'
+                                    '&chart_type=line', json={**scope, 'status': '[>]1'}).json()
+        assert res['data']['xAxis']['data'] == ['2022-01', '2022-02']
+        assert [(item['name'], item['type'], item['data']) for item in res['data']['series']] == [
+            (str(c2), 'line', [1, None]), (str(c1), 'line', [None, 1])]
+        # 缓存在数据写入后失效
+        assert aggregate_client.post('/article/aggregate', json=scope).json()['data']['series'][0]['data'] == [3]
+        ids = [item['id'] for item in aggregate_client.post('/article/list', json=scope).json()['data']['items']]
+        aggregate_client.delete(f'/article/item/{ids[0]}')
+        res = aggregate_client.post('/article/aggregate', json=scope).json()
+        assert res['data']['series'][0]['data'] == [2]
+        assert aggregate_client.post('/article/aggregate?metrics=sum:unknown').status_code == 400
+        # 按ISO周分组: 2022-01-02 属于 2021 年第 52 周
+        weeks = [{'title': title, 'description': 'aggregate_week'} for title in ['2022-01-02', '2022-01-03']]
+        aggregate_client.post('/article/item', json=weeks)
+        res = aggregate_client.post('/article/aggregate?date_field=title&date_bucket=week',
+                                    json={'description': 'aggregate_week'}).json()
+        assert res['data']['xAxis']['data'] == ['2021-52', '2022-01'], res
+        week_ids = [item['id'] for item in aggregate_client.post(
+            '/article/list', json={'description': 'aggregate_week'}).json()['data']['items']]
+        aggregate_client.delete(f'/article/item/{",".join(map(str, ids[1:] + week_ids))}')
+        client.delete(f'/category/item/{c1},{c2}')
+
+    def test_list_sparse_fields(self):
+        client.post('/category/item', json=[{'name': 'sparse_a', 'description': 'a' * 100}, {'name': 'sparse_b'}])
+        res = client.post('/category/list?fields=name', json={'name': '[~]sparse_%'}).json()
+        assert res['data']['items'] == [{'id': res['data']['items'][0]['id'], 'name': 'sparse_a'},
+                                        {'id': res['data']['items'][1]['id'], 'name': 'sparse_b'}]  # 主键始终保留
+        res = client.post('/category/list?fields=name,unknown,description', json={'name': '[~]sparse_%'}).json()
+        assert set(res['data']['items'][0]) == {'id', 'name', 'description'}
+        stmt = category_crud._calc_sparse_select(select(*category_crud._list_fields_ins.values()), 'name',
+                                                 category_crud.paginator())
+        assert [column.name for column in stmt.selected_columns] == ['id', 'name']
+        assert category_crud._get_list_schema(stmt) is category_crud._get_list_schema(stmt)
+
+        class CategoryCrud(SQLModelCrud):
+            response_raw = True
+
+        raw_app = FastAPI()
+        raw_app.include_router(CategoryCrud(Category, session_factory).register_crud().router)
+        raw_res = TestClient(raw_app).post('/category/list?fields=name', json={'name': '[~]sparse_%'}).json()
+        res = client.post('/category/list?fields=name', json={'name': '[~]sparse_%'}).json()
+        assert raw_res == res, (raw_res, res)  # 裁剪后的响应与response_raw无关
+
+        class BoundedCrud(SQLModelCrud):
+            filter_cache_size = 2
+
+        bounded_crud = BoundedCrud(Category, session_factory)
+        bounded_client = crud_client(bounded_crud)
+        for fields in ['name', 'description', 'name,description', 'name']:  # 客户端字段组合不会无限增加缓存
+            bounded_client.post(f'/category/list?fields={fields}', json={'name': '[~]sparse_%'})
+        assert len(bounded_crud._list_schemas) == 2 and len(bounded_crud._row_mappers) == 2
+        ids = ','.join(str(item['id']) for item in res['data']['items'])
+        client.delete(f'/category/item/{ids}')
+
+    def test_list_preview(self):
+        assert SQLModelCrud(Article, session_factory)._list_previews == {}  # 默认不截取
+
+        class ArticleCrud(SQLModelCrud):
+            list_preview_length = 10
+
+        article_crud = ArticleCrud(Article, session_factory).register_crud()
+        assert article_crud._list_previews == {'description': 10}
+        preview_app = FastAPI()
+        preview_app.include_router(article_crud.router)
+        preview_client = TestClient(preview_app)
+        item = preview_client.post('/article/item', json={'title': 'preview', 'description': 'x' * 300}).json()['data']
+        res = preview_client.post('/article/list', json={'title': 'preview'}).json()
+        assert res['data']['items'][0]['description'] == 'x' * 10  # 列表只查询截取的内容
+        res = preview_client.post('/article/list?fields=title', json={'title': 'preview'}).json()
+        assert 'description' not in res['data']['items'][0]
+        assert preview_client.get(f'/article/item/{item["id"]}').json()['data']['description'] == 'x' * 300
+        preview_client.delete(f'/article/item/{item["id"]}')
+
+    def test_link_strategy(self):
+        link_table = ArticleTagLink.__table__
+
+        class TagCrud(SQLModelCrud):
+            link_models = {'article': (link_table, link_table.c.tag_id, link_table.c.article_id)}
+
+        tag_link_crud = TagCrud(Tag, session_factory).register_crud()
+        link_app = FastAPI()
+        link_app.include_router(tag_link_crud.router)
+        link_client = TestClient(link_app)
+        tags = [{'name': f'link_tag_{i}'} for i in range(4)]
+        assert link_client.post('/tag/item', json=tags).json()['data'] == 4
+        tag_ids = [item['id'] for item in link_client.post('/tag/list', json={'name': '[~]link_tag_%'}).json()[
+            'data']['items']]
+
+        async def add_links():
+            async for session in session_factory():
+                await session.execute(insert(link_table), [{'tag_id': tag_ids[0], 'article_id': 1},
+                                                           {'tag_id': tag_ids[1], 'article_id': 1},
+                                                           {'tag_id': tag_ids[1], 'article_id': 2}])
+                await session.commit()
+
+        asyncio.run(add_links())
+        for strategy in ['in', 'exists', 'join', None]:
+            tag_link_crud.link_strategy = strategy
+            for link_item_id, expected in [('1', tag_ids[:2]), ('1,2', tag_ids[:2]), ('!1', tag_ids[2:]),
+                                           ('!1,2', tag_ids[2:])]:
+                res = link_client.post(f'/tag/list?link_model=article&link_item_id={link_item_id}',
+                                       json={'name': '[~]link_tag_%'}).json()
+                assert [item['id'] for item in res['data']['items']] == expected, (strategy, link_item_id)
+                assert res['data']['total'] == len(expected), (strategy, link_item_id)
+        link = LinkClause(link_table, link_table.c.tag_id, link_table.c.article_id, ['1'], True)
+        stmt = tag_link_crud.calc_link_select(select(Tag.id), link, 'mysql')
+        assert 'LEFT OUTER JOIN' in str(stmt) and 'NOT IN' not in str(stmt)
+        assert 'NOT (EXISTS' in str(tag_link_crud.calc_link_select(select(Tag.id), link, 'postgresql'))
+
+        class ClauseTagCrud(TagCrud):  # 重写的get_link_clause返回过滤条件表达式
+            async def get_link_clause(self, request: Request, link_model: str = None, link_item_id: str = None):
+                if link_model == 'article' and link_item_id:
+                    return Tag.id.in_(select(link_table.c.tag_id).where(link_table.c.article_id == int(link_item_id)))
+                return None
+
+        clause_app = FastAPI()
+        clause_app.include_router(ClauseTagCrud(Tag, session_factory).register_crud().router)
+        res = TestClient(clause_app).post('/tag/list?link_model=article&link_item_id=2',
+                                          json={'name': '[~]link_tag_%'}).json()
+        assert [item['id'] for item in res['data']['items']] == tag_ids[1:2], res
+
+        async def clear_links():
+            async for session in session_factory():
+                await session.execute(link_table.delete())
+                await session.commit()
+
+        asyncio.run(clear_links())
+        link_client.delete(f'/tag/item/{",".join(map(str, tag_ids))}')